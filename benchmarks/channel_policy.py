@@ -0,0 +1,87 @@
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.policy_store import GuildPolicy
+
+CHANNEL_ID_BASE = 1_000_000_000_000_000_000
+
+def build_guilds(guild_count: int, channels_per_guild: int, seed: int):
+    rng = random.Random(seed)
+    guilds = {}
+    for guild_id in range(guild_count):
+        start = CHANNEL_ID_BASE + guild_id * channels_per_guild * 4
+        guilds[guild_id] = rng.sample(range(start, start + channels_per_guild * 4), channels_per_guild)
+    return guilds
+
+def build_lookups(guilds, lookup_count: int, hit_ratio: float, seed: int):
+    rng = random.Random(seed + 1)
+    guild_ids = list(guilds)
+    lookups = []
+    for _ in range(lookup_count):
+        guild_id = rng.choice(guild_ids)
+        channels = guilds[guild_id]
+        channel_id = rng.choice(channels) if rng.random() < hit_ratio else channels[0] + 1_000_000_000
+        lookups.append((guild_id, channel_id))
+    return lookups
+
+def time_lookups(check, lookups, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for guild_id, channel_id in lookups:
+            check(guild_id, channel_id)
+        best = min(best, time.perf_counter() - started)
+    return best / len(lookups) * 1e9
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    structure = build()
+    build_seconds = time.perf_counter() - started
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+    return structure, build_seconds, memory_mb
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-message channel allow-list check cost.")
+    parser.add_argument('--guilds', type=int, default=10000)
+    parser.add_argument('--channels', type=int, default=500)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--hit-ratio', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    print(f"Building {args.guilds} guilds x {args.channels} channels...")
+    guilds = build_guilds(args.guilds, args.channels, args.seed)
+    lookups = build_lookups(guilds, args.lookups, args.hit_ratio, args.seed)
+
+    lists, list_build, list_memory = measure(lambda: {guild_id: list(channels) for guild_id, channels in guilds.items()})
+    policies, policy_build, policy_memory = measure(lambda: {guild_id: GuildPolicy(guild_id, channels) for guild_id, channels in guilds.items()})
+
+    def list_check(guild_id, channel_id):
+        restrictions = lists.get(guild_id)
+        return restrictions is None or channel_id in restrictions
+
+    def policy_check(guild_id, channel_id):
+        return policies[guild_id].allows(channel_id)
+
+    for guild_id, channel_id in lookups[:1000]:
+        assert list_check(guild_id, channel_id) == policy_check(guild_id, channel_id)
+
+    list_ns = time_lookups(list_check, lookups, args.repeat)
+    policy_ns = time_lookups(policy_check, lookups, args.repeat)
+
+    print(f"{'structure':<22}{'ns/check':>12}{'build s':>10}{'memory MB':>12}")
+    print(f"{'list scan':<22}{list_ns:>12.0f}{list_build:>10.2f}{list_memory:>12.1f}")
+    print(f"{'GuildPolicy frozenset':<22}{policy_ns:>12.0f}{policy_build:>10.2f}{policy_memory:>12.1f}")
+    print(f"Speedup: {list_ns / policy_ns:.1f}x over {args.lookups} lookups ({args.hit_ratio:.0%} allowed).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import resource
+import tracemalloc
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from database.policy_store import GuildPolicyStore
+from utils.ai_utils import AIResponseError
+from utils.conversation import ConversationStore
+from utils.instructions import InstructionsManager
+from utils.rate_limit import RateLimiter
+from utils.response_cache import ResponseCache
+from utils.scheduler import FairScheduler
+
+
+class FakeWriteQueue:
+    def stats(self) -> Dict[str, int]:
+        return {'pending': 0, 'queued': 0, 'coalesced': 0, 'flushed': 0, 'batches': 0, 'failures': 0, 'dropped': 0}
+
+
+class FakeMongo:
+    def __init__(self, latency_ms: float, restricted_ratio: float, seed: int):
+        self.latency = latency_ms / 1000
+        self.restricted_ratio = restricted_ratio
+        self.rng = random.Random(seed)
+        self.writes = FakeWriteQueue()
+        self.cache: Dict[str, str] = {}
+        self.conversations: Dict[str, Dict[str, Any]] = {}
+        self.operations = 0
+
+    async def _io(self):
+        self.operations += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def load_configs(self, guild_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        await self._io()
+        configs = {}
+        for guild_id in guild_ids:
+            if self.rng.random() < self.restricted_ratio:
+                configs[guild_id] = {'guild_id': guild_id, 'is_restricted': True, 'allowed_channels': [guild_id * 10 + i for i in range(5)], 'version': 1}
+        return configs
+
+    async def ensure_response_cache_indexes(self):
+        pass
+
+    async def get_cached_response(self, key: str) -> Optional[str]:
+        await self._io()
+        return self.cache.get(key)
+
+    async def set_cached_response(self, key: str, response: str, ttl_seconds: int):
+        await self._io()
+        self.cache[key] = response
+
+    async def ensure_conversation_indexes(self, ttl_seconds: int):
+        pass
+
+    async def load_conversation(self, key: str) -> Optional[Dict[str, Any]]:
+        await self._io()
+        return self.conversations.get(key)
+
+    def save_conversation(self, document: Dict[str, Any]):
+        self.conversations[document['key']] = document
+
+
+class StubGemini:
+    def __init__(self, latency_ms: float, jitter: float, error_rate: float, blocked_rate: float, response_chars: int, seed: int):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.blocked_rate = blocked_rate
+        self.response_chars = response_chars
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self) -> float:
+        return self.latency * self.rng.lognormvariate(0, self.jitter) if self.jitter else self.latency
+
+    def _maybe_fail(self):
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            raise AIResponseError("An error occurred while contacting the AI (StubError). Please try again later.")
+        if roll < self.error_rate + self.blocked_rate:
+            raise AIResponseError("My response was blocked (Reason: SAFETY).", reason="blocked")
+
+    def _text(self, user_message: str) -> str:
+        body = f"Answer to: {user_message}. "
+        return (body * (self.response_chars // len(body) + 1))[:self.response_chars]
+
+    async def get_ai_response(self, user_message: str, context=None, max_output_tokens: Optional[int] = None, instructions=None, usage=None) -> str:
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        return self._text(user_message)
+
+    async def stream_ai_response(self, user_message: str, context=None, max_output_tokens: Optional[int] = None, instructions=None, usage=None):
+        self.calls += 1
+        delay = self._delay()
+        await asyncio.sleep(delay / 4)
+        self._maybe_fail()
+        text = self._text(user_message)
+        step = max(1, len(text) // 8)
+        for start in range(0, len(text), step):
+            await asyncio.sleep(delay * 3 / 4 / 8)
+            yield text[start:start + step]
+
+
+class FakeUser:
+    def __init__(self, user_id: int, bot: bool = False):
+        self.id = user_id
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeSentMessage:
+    def __init__(self, channel: "FakeChannel", content: str):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content: Optional[str] = None, **kwargs):
+        await self.channel.discord_io()
+        self.content = content
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: Optional[FakeGuild], stats: "RunStats", send_latency: float):
+        self.id = channel_id
+        self.guild = guild
+        self.stats = stats
+        self.send_latency = send_latency
+
+    async def discord_io(self):
+        self.stats.discord_calls += 1
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+
+    @asynccontextmanager
+    async def _typing(self):
+        yield
+
+    def typing(self):
+        return self._typing()
+
+    async def send(self, content: str = "", **kwargs) -> FakeSentMessage:
+        await self.discord_io()
+        return FakeSentMessage(self, content)
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, author: FakeUser, channel: FakeChannel, bot_user: FakeUser, text: str):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.mentions = [bot_user]
+        self.content = f"<@{bot_user.id}> {text}"
+        self.clean_content = self.content
+        self.attachments = []
+        self.reference = None
+
+    async def reply(self, content: str = "", **kwargs) -> FakeSentMessage:
+        await self.channel.discord_io()
+        return FakeSentMessage(self.channel, content)
+
+
+class RunStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.discord_calls = 0
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def build_bot(args, db: FakeMongo) -> main.ScriptlyBot:
+    bot = main.ScriptlyBot()
+    bot._connection.user = FakeUser(1, bot=True)
+    bot.db_client = db
+    bot.policy_store = GuildPolicyStore(db)
+    bot.instructions = InstructionsManager(db_client=db)
+    await bot.instructions.load()
+    bot.rate_limiter = RateLimiter({scope: (1e9, 10 ** 9) for scope in ('user', 'channel', 'guild')}) if not args.rate_limits else bot.rate_limiter
+    bot.stream_responses = args.stream
+    bot.stream_edit_interval = 0.05
+    if not args.no_cache:
+        bot.response_cache = ResponseCache(db_client=db)
+    if not args.no_memory:
+        bot.conversations = ConversationStore(db_client=db, summarizer=None)
+        await bot.conversations.setup()
+    bot.scheduler = FairScheduler(max_concurrency=args.ai_concurrency, max_queue_size=args.queue_size, max_per_key=args.queue_size)
+    bot.scheduler.start()
+    return bot
+
+
+async def run_level(args, concurrency: int) -> Dict[str, float]:
+    db = FakeMongo(args.db_latency_ms, args.restricted_ratio, args.seed)
+    stub = StubGemini(args.ai_latency_ms, args.ai_jitter, args.error_rate, args.blocked_rate, args.response_chars, args.seed)
+    main.get_ai_response = stub.get_ai_response
+    main.stream_ai_response = stub.stream_ai_response
+
+    bot = await build_bot(args, db)
+    stats = RunStats()
+    rng = random.Random(args.seed)
+    guilds = [FakeGuild(guild_id) for guild_id in range(1000, 1000 + args.guilds)]
+    channels = [FakeChannel(guild.id * 10 + index, guild, stats, args.discord_latency_ms / 1000) for guild in guilds for index in range(5)]
+    users = [FakeUser(100000 + index) for index in range(args.users)]
+    questions = [f"question number {index} about python" for index in range(args.distinct_questions)]
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for message_id in range(args.messages):
+        queue.put_nowait(FakeMessage(10 ** 12 + message_id, rng.choice(users), rng.choice(channels), bot.user, rng.choice(questions)))
+
+    async def worker():
+        while True:
+            try:
+                message = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            await bot.on_message(message)
+            stats.latencies.append(time.perf_counter() - started)
+
+    monitor = LoopLagMonitor()
+    if args.trace_memory:
+        tracemalloc.start()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+    traced_peak = tracemalloc.get_traced_memory()[1] / 1e6 if args.trace_memory else 0.0
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    scheduler_stats = bot.scheduler.stats()
+    await bot.scheduler.close()
+    if bot.conversations:
+        await bot.conversations.close()
+    if bot.response_cache:
+        await bot.response_cache.close()
+
+    return {
+        'concurrency': concurrency,
+        'messages': len(stats.latencies),
+        'msgs_per_sec': len(stats.latencies) / elapsed,
+        'p50_ms': percentile(stats.latencies, 0.5) * 1000,
+        'p99_ms': percentile(stats.latencies, 0.99) * 1000,
+        'lag_p99_ms': percentile(monitor.samples, 0.99) * 1000,
+        'lag_max_ms': max(monitor.samples, default=0.0) * 1000,
+        'ai_calls': stub.calls,
+        'db_ops': db.operations,
+        'rejected': scheduler_stats['rejected'],
+        'traced_peak_mb': traced_peak,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def print_results(results: List[Dict[str, float]]):
+    columns = [
+        ('concurrency', 'conc', '{:.0f}'), ('msgs_per_sec', 'msg/s', '{:.1f}'),
+        ('p50_ms', 'p50 ms', '{:.1f}'), ('p99_ms', 'p99 ms', '{:.1f}'),
+        ('lag_p99_ms', 'lag p99', '{:.1f}'), ('lag_max_ms', 'lag max', '{:.1f}'),
+        ('ai_calls', 'AI calls', '{:.0f}'), ('db_ops', 'DB ops', '{:.0f}'), ('rejected', 'busy', '{:.0f}'),
+        ('traced_peak_mb', 'heap MB', '{:.1f}'), ('max_rss_mb', 'RSS MB', '{:.1f}'),
+    ]
+    print("".join(f"{header:>10}" for _, header, _ in columns))
+    for result in results:
+        print("".join(f"{fmt.format(result[key]):>10}" for key, _, fmt in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test for ScriptlyBot.on_message with stubbed Discord, Gemini and MongoDB.")
+    parser.add_argument('--concurrency', default="1,10,50,200", help="Comma-separated concurrency levels.")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--guilds', type=int, default=50)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--distinct-questions', type=int, default=200)
+    parser.add_argument('--ai-latency-ms', type=float, default=50.0)
+    parser.add_argument('--ai-jitter', type=float, default=0.5, help="Sigma of the lognormal latency multiplier.")
+    parser.add_argument('--ai-concurrency', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--blocked-rate', type=float, default=0.01)
+    parser.add_argument('--response-chars', type=int, default=800)
+    parser.add_argument('--db-latency-ms', type=float, default=1.0)
+    parser.add_argument('--discord-latency-ms', type=float, default=5.0)
+    parser.add_argument('--restricted-ratio', type=float, default=0.0)
+    parser.add_argument('--queue-size', type=int, default=100000)
+    parser.add_argument('--stream', action='store_true', help="Use the streaming reply path.")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--no-memory', action='store_true', help="Disable conversation memory.")
+    parser.add_argument('--rate-limits', action='store_true', help="Keep the default per-user/channel/guild rate limits.")
+    parser.add_argument('--trace-memory', action='store_true', help="Report tracemalloc peak (slower).")
+    parser.add_argument('--seed', type=int, default=1234)
+    return parser.parse_args()
+
+
+async def run(args):
+    results = []
+    for level in (int(value) for value in args.concurrency.split(",")):
+        results.append(await run_level(args, level))
+    print_results(results)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.setdefault("GOOGLE_GEMINI_API_KEY", "offline-benchmark")
+    asyncio.run(run(parse_args()))
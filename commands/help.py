@@ -18,11 +18,12 @@ class HelpCog(commands.Cog):
             inline=False
         )
 
-        allowed_for_guild = self.bot.allowed_channels.get(ctx.guild.id) if ctx.guild else None
+        policy = await self.bot.policy_store.get(ctx.guild.id) if ctx.guild else None
+        allowed_for_guild = policy.allowed_channels if policy else None
 
         if ctx.guild and allowed_for_guild:
             channel_mentions = []
-            for ch_id in allowed_for_guild:
+            for ch_id in sorted(allowed_for_guild):
                 channel = ctx.guild.get_channel(ch_id)
                 if channel:
                     channel_mentions.append(channel.mention)
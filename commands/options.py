@@ -1,7 +1,9 @@
 import discord
 from discord import ui
 from discord.ext import commands
-from typing import List, Optional
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+
+from database.policy_store import GuildPolicy
 
 class AddChannelModal(ui.Modal, title="Add Channel to Restriction"):
     channel_id_input = ui.TextInput(
@@ -28,7 +30,7 @@ class AddChannelModal(ui.Modal, title="Add Channel to Restriction"):
                 await interaction.response.send_message(f"{channel.mention} is already in the list.", ephemeral=True)
                 return
 
-            self.view.restricted_channels.append(channel_id)
+            self.view.restricted_channels = self.view.restricted_channels | {channel_id}
             await self.view.update_message(interaction, status_message=f"Added {channel.mention} to the list.")
 
         except ValueError:
@@ -37,13 +39,14 @@ class AddChannelModal(ui.Modal, title="Add Channel to Restriction"):
             await interaction.response.send_message(f"An error occurred: {e}", ephemeral=True)
 
 class OptionsView(ui.View):
-    def __init__(self, bot: commands.Bot, guild_id: int, initial_channels: Optional[List[int]]):
+    def __init__(self, bot: commands.Bot, guild_id: int, initial_channels: Optional[Iterable[int]], initial_settings: Optional[Dict[str, Any]] = None):
         super().__init__(timeout=300)
         self.bot = bot
         self.guild_id = guild_id
         self.is_restricted = initial_channels is not None
-        self.restricted_channels = initial_channels or []
-        self.original_state = (self.is_restricted, list(self.restricted_channels))
+        self.restricted_channels: FrozenSet[int] = frozenset(initial_channels or ())
+        self.cache_enabled = (initial_settings or {}).get('cache_enabled', True)
+        self.original_state = (self.is_restricted, self.restricted_channels, self.cache_enabled)
         self._update_buttons()
 
     def _update_buttons(self):
@@ -65,6 +68,11 @@ class OptionsView(ui.View):
         self.add_item(self.remove_channel_button)
 
 
+        cache_label = "Disable Response Cache" if self.cache_enabled else "Enable Response Cache"
+        self.cache_button = ui.Button(label=cache_label, style=discord.ButtonStyle.secondary, custom_id="toggle_cache")
+        self.cache_button.callback = self.toggle_cache
+        self.add_item(self.cache_button)
+
         self.save_button = ui.Button(label="Save Configuration", style=discord.ButtonStyle.success, custom_id="save_config", disabled=not self._has_changes())
         self.save_button.callback = self.save_configuration
         self.add_item(self.save_button)
@@ -93,11 +101,11 @@ class OptionsView(ui.View):
                 mentions = []
                 guild = self.bot.get_guild(self.guild_id)
                 if guild:
-                    for cid in self.restricted_channels:
+                    for cid in sorted(self.restricted_channels):
                         channel = guild.get_channel(cid)
                         mentions.append(channel.mention if channel else f"`{cid}` (Unknown)")
                 else:
-                     mentions = [f"`{cid}`" for cid in self.restricted_channels]
+                     mentions = [f"`{cid}`" for cid in sorted(self.restricted_channels)]
 
                 desc += "└ Allowed Channels:\n" + "\n".join([f"   • {m}" for m in mentions])
             else:
@@ -105,15 +113,16 @@ class OptionsView(ui.View):
         else:
             desc += "└ Bot usable in **all channels**."
 
+        cache_status = "✅ Enabled" if self.cache_enabled else "❌ Disabled"
+        desc += f"\nResponse Cache: **{cache_status}**\n└ Repeated questions are answered from cache."
+
         embed = discord.Embed(title=title, description=desc, color=discord.Color.blue())
         embed.set_image(url="https://cdn.discordapp.com/attachments/1357547210916626594/1362639312675405914/9fpOS21.png?ex=68032040&is=6801cec0&hm=73cc7078d8659bbeab872afc45c3bdd20560cb3ac611c81a92a7631a9ebb72d6&")
         embed.set_footer(text="Changes are temporary until saved.")
         return embed
 
     def _has_changes(self) -> bool:
-         current_state = (self.is_restricted, sorted(self.restricted_channels))
-         original_state = (self.original_state[0], sorted(self.original_state[1]))
-         return current_state != original_state
+         return (self.is_restricted, self.restricted_channels, self.cache_enabled) != self.original_state
 
     async def update_message(self, interaction: discord.Interaction, status_message: Optional[str] = None):
         self._update_buttons()
@@ -127,9 +136,13 @@ class OptionsView(ui.View):
     async def toggle_restriction(self, interaction: discord.Interaction):
         self.is_restricted = not self.is_restricted
         if not self.is_restricted:
-            self.restricted_channels = []
+            self.restricted_channels = frozenset()
         await self.update_message(interaction, status_message=f"Channel restriction {'enabled' if self.is_restricted else 'disabled'}.")
 
+    async def toggle_cache(self, interaction: discord.Interaction):
+        self.cache_enabled = not self.cache_enabled
+        await self.update_message(interaction, status_message=f"Response cache {'enabled' if self.cache_enabled else 'disabled'}.")
+
     async def add_channel(self, interaction: discord.Interaction):
         await interaction.response.send_modal(AddChannelModal(self))
 
@@ -140,7 +153,7 @@ class OptionsView(ui.View):
 
          options = []
          guild = interaction.guild
-         for channel_id in self.restricted_channels:
+         for channel_id in sorted(self.restricted_channels):
              channel = guild.get_channel(channel_id)
              label = channel.name if channel else str(channel_id)
              options.append(discord.SelectOption(label=label, value=str(channel_id), description=f"ID: {channel_id}"))
@@ -158,21 +171,17 @@ class OptionsView(ui.View):
          await interaction.response.send_message("Select channels to remove from the allowed list:", view=view, ephemeral=True)
 
     async def handle_remove_selection(self, interaction: discord.Interaction):
-         selected_ids = [int(val) for val in interaction.data['values']]
-         removed_count = 0
-         removed_mentions = []
+         selected_ids = {int(val) for val in interaction.data['values']}
          guild = interaction.guild
 
-         new_list = []
-         for cid in self.restricted_channels:
-             if cid not in selected_ids:
-                 new_list.append(cid)
-             else:
-                 removed_count += 1
-                 channel = guild.get_channel(cid)
-                 removed_mentions.append(channel.mention if channel else f"`{cid}`")
+         removed = self.restricted_channels & selected_ids
+         removed_count = len(removed)
+         removed_mentions = []
+         for cid in sorted(removed):
+             channel = guild.get_channel(cid)
+             removed_mentions.append(channel.mention if channel else f"`{cid}`")
 
-         self.restricted_channels = new_list
+         self.restricted_channels = self.restricted_channels - removed
 
          await interaction.message.delete()
          await self.update_message(interaction, status_message=f"Removed {removed_count} channel(s): {', '.join(removed_mentions)}")
@@ -180,19 +189,27 @@ class OptionsView(ui.View):
 
     async def save_configuration(self, interaction: discord.Interaction):
         try:
-            await self.bot.db_client.save_config(self.guild_id, self.is_restricted, self.restricted_channels)
-            self.bot.allowed_channels[self.guild_id] = self.restricted_channels if self.is_restricted else None
-            self.original_state = (self.is_restricted, list(self.restricted_channels))
+            await interaction.response.defer()
+            settings = {'cache_enabled': self.cache_enabled}
+            saved = await self.bot.db_client.save_config(self.guild_id, self.is_restricted, sorted(self.restricted_channels), settings)
+            current = self.bot.policy_store.peek(self.guild_id) or GuildPolicy(self.guild_id)
+            self.bot.policy_store.put(current.replace(self.restricted_channels if self.is_restricted else None, settings))
+            if not saved:
+                await self.update_message(interaction, status_message="⚠️ The database did not confirm the save. The new settings are active for now and the save will be retried, but they may be lost if the bot restarts. Try saving again in a minute.")
+                return
+            self.original_state = (self.is_restricted, self.restricted_channels, self.cache_enabled)
             self.saved_once = True
             await self.update_message(interaction, status_message="Configuration saved successfully!")
 
         except Exception as e:
-             await interaction.response.send_message(f"Failed to save configuration: {e}", ephemeral=True)
+             if interaction.response.is_done():
+                 await interaction.followup.send(f"Failed to save configuration: {e}", ephemeral=True)
+             else:
+                 await interaction.response.send_message(f"Failed to save configuration: {e}", ephemeral=True)
 
 
     async def cancel_changes(self, interaction: discord.Interaction):
-         self.is_restricted, self.restricted_channels = self.original_state
-         self.restricted_channels = list(self.restricted_channels)
+         self.is_restricted, self.restricted_channels, self.cache_enabled = self.original_state
          await self.update_message(interaction, status_message="Changes cancelled.")
 
 
@@ -217,8 +234,8 @@ class OptionsCog(commands.Cog):
              await interaction.response.send_message("This command can only be used in a server.", ephemeral=True)
              return
 
-        initial_channels = self.bot.allowed_channels.get(interaction.guild_id)
-        view = OptionsView(self.bot, interaction.guild_id, initial_channels)
+        policy = await self.bot.policy_store.get(interaction.guild_id)
+        view = OptionsView(self.bot, interaction.guild_id, policy.allowed_channels, policy.settings)
         embed = view._build_embed()
         await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
@@ -0,0 +1,168 @@
+import discord
+from discord.ext import commands
+
+from utils.metrics import GEMINI_LATENCY, DISCORD_SEND_LATENCY, MONGO_LATENCY, MENTION_LATENCY
+
+class StatsCog(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @commands.command(name="scriptlystats")
+    @commands.is_owner()
+    async def scriptly_stats(self, ctx: commands.Context):
+        embed = discord.Embed(title="Scriptly Runtime Stats", color=discord.Color.blue())
+
+        scheduler = getattr(self.bot, 'scheduler', None)
+        if scheduler:
+            stats = scheduler.stats()
+            embed.add_field(
+                name="AI Queue",
+                value=(
+                    f"Depth: **{stats['queue_depth']}** / {scheduler.max_queue_size} ({stats['queued_keys']} guild(s))\n"
+                    f"In flight: **{stats['in_flight']}** / {scheduler.max_concurrency}\n"
+                    f"Wait avg/p95/max: {stats['wait_avg_ms']} / {stats['wait_p95_ms']} / {stats['wait_max_ms']} ms\n"
+                    f"Completed: {stats['completed']} | Rejected: {stats['rejected']}"
+                ),
+                inline=False
+            )
+
+        response_cache = getattr(self.bot, 'response_cache', None)
+        if response_cache:
+            stats = response_cache.stats()
+            embed.add_field(
+                name="Response Cache",
+                value=(
+                    f"Hits L1/L2: **{stats['l1_hits']}** / **{stats['l2_hits']}** | Misses: {stats['misses']}\n"
+                    f"Hit rate: {stats['hit_rate_pct']}% | L1 entries: {stats['l1_size']}"
+                ),
+                inline=False
+            )
+
+        attachments = getattr(self.bot, 'attachments', None)
+        if attachments:
+            stats = attachments.stats()
+            embed.add_field(
+                name="Attachments",
+                value=f"Read: **{stats['files_read']}** ({stats['bytes_read'] // 1024} KiB) | Truncated: {stats['truncated']} | Skipped: {stats['skipped']} | Failed: {stats['failed']}",
+                inline=False
+            )
+
+        similar_questions = getattr(self.bot, 'similar_questions', None)
+        if similar_questions:
+            stats = similar_questions.stats()
+            embed.add_field(
+                name="Similar Questions",
+                value=f"Indexed: **{stats['size']}**/{stats['capacity']} | Hit rate: {stats['hit_rate_pct']}% ({stats['hits']} hits, {stats['misses']} misses) | Evictions: {stats['evictions']} | Rejected: {stats['rejected']}",
+                inline=False
+            )
+
+        single_flight = getattr(self.bot, 'single_flight', None)
+        if single_flight:
+            stats = single_flight.stats()
+            embed.add_field(
+                name="Request Coalescing",
+                value=f"Upstream calls: **{stats['leaders']}** | Coalesced: **{stats['coalesced']}** | In flight: {stats['in_flight']}",
+                inline=False
+            )
+
+        conversations = getattr(self.bot, 'conversations', None)
+        if conversations:
+            stats = conversations.stats()
+            embed.add_field(
+                name="Conversation Memory",
+                value=f"Active: **{stats['conversations']}** | Compactions: {stats['compactions']}",
+                inline=False
+            )
+
+        policy_store = getattr(self.bot, 'policy_store', None)
+        if policy_store:
+            stats = policy_store.stats()
+            embed.add_field(
+                name="Guild Policies",
+                value=f"Cached: **{stats['cached']}** | Hits: {stats['hits']} | Misses: {stats['misses']} | DB batches: {stats['batches']}",
+                inline=False
+            )
+
+        instructions = getattr(self.bot, 'instructions', None)
+        if instructions:
+            stats = instructions.stats()
+            embed.add_field(
+                name="Instructions",
+                value=f"Version: **{stats['version']}** | Reloads: {stats['reloads']} | Profiles cached: {stats['profiles']} | Hits: {stats['hits']} | Misses: {stats['misses']}",
+                inline=False
+            )
+
+        db_client = getattr(self.bot, 'db_client', None)
+        if db_client:
+            stats = db_client.writes.stats()
+            embed.add_field(
+                name="DB Write Queue",
+                value=f"Pending: **{stats['pending']}** | Queued: {stats['queued']} | Coalesced: {stats['coalesced']} | Flushed: {stats['flushed']} in {stats['batches']} batch(es) | Failures: {stats['failures']}",
+                inline=False
+            )
+            stats = db_client.schema.stats()
+            embed.add_field(
+                name="DB Schema",
+                value=f"Version: **{stats['version']}**/{stats['target_version']} | Indexes ensured: {stats['ensured']} | TTLs updated: {stats['updated']} | Failed: {stats['failed']} | Duplicate guilds: {stats['duplicate_guilds']} | Duplicates removed: {stats['duplicates_removed']}",
+                inline=False
+            )
+
+        config_watcher = getattr(self.bot, 'config_watcher', None)
+        if config_watcher:
+            stats = config_watcher.stats()
+            embed.add_field(
+                name="Config Sync",
+                value=f"Mode: **{stats['mode']}** | Updates applied: {stats['updates_applied']} | Tracked guilds: {stats['tracked_guilds']}",
+                inline=False
+            )
+
+        usage = getattr(self.bot, 'usage', None)
+        token_budget = getattr(self.bot, 'token_budget', None)
+        if usage and token_budget:
+            stats = usage.stats()
+            budget = token_budget.stats()
+            embed.add_field(
+                name="Token Usage",
+                value=f"Today: **{stats['tokens_today']}** tokens across {stats['guilds_today']} guild(s) | Capped: {stats['capped']} | Truncated prompts: {budget['truncated']} | Rejected: {budget['rejected']}",
+                inline=False
+            )
+
+        load_tracker = getattr(self.bot, 'load_tracker', None)
+        if load_tracker:
+            stats = load_tracker.stats()
+            embed.add_field(
+                name="Load",
+                value=f"Mode: **{'degraded' if stats['degraded'] else 'normal'}** | {stats['rate_per_minute']}/min | p95 {stats['p95_ms']} ms | Degraded {stats['times_degraded']}x | Shed: {stats['shed']}",
+                inline=False
+            )
+
+        latency_lines = []
+        for label, histogram in (("Mention", MENTION_LATENCY), ("Gemini", GEMINI_LATENCY), ("Discord send", DISCORD_SEND_LATENCY), ("MongoDB", MONGO_LATENCY)):
+            p50, p99 = histogram.quantile(0.5), histogram.quantile(0.99)
+            if p50 is not None:
+                latency_lines.append(f"{label}: p50 {p50 * 1000:.0f} ms | p99 {p99 * 1000:.0f} ms")
+        if latency_lines:
+            embed.add_field(name="Latency", value="\n".join(latency_lines), inline=False)
+
+        ai_client = getattr(self.bot, 'ai_client', None)
+        rate_limiter = getattr(self.bot, 'rate_limiter', None)
+        if ai_client or rate_limiter:
+            lines = []
+            if ai_client:
+                stats = ai_client.stats()
+                for route in stats['routes']:
+                    p95 = f"{route['p95_ms']} ms" if route['p95_ms'] is not None else "n/a"
+                    quota = f" | quota {route['quota']}%" if route['quota'] is not None else ""
+                    lines.append(f"Gemini {route['name']}: **{route['state']}** | p95 {p95} | errors {route['error_rate']}%{quota} | in flight {route['in_flight']}")
+                lines.append(f"Failovers: {stats['failovers']} | Hedged: {stats['hedged']} (won {stats['hedge_wins']})")
+            if rate_limiter:
+                stats = rate_limiter.stats()
+                lines.append(f"Rate limited mentions: {stats['limited']} | Active buckets: {stats['buckets']}")
+            embed.add_field(name="Rate Limiting", value="\n".join(lines), inline=False)
+
+        if not embed.fields:
+            embed.description = "No runtime subsystems are active."
+        await ctx.reply(embed=embed, mention_author=False)
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(StatsCog(bot))
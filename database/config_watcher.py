@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from pymongo.errors import OperationFailure
+
+from database.mongo_client import CONFIG_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAMS_UNSUPPORTED_CODES = {40573, 40324, 136}
+
+
+class ConfigWatcher:
+    def __init__(self, db_client, on_change: Callable[[int, Optional[Dict[str, Any]]], None], poll_interval: float = 1.0, poll_overlap: float = 2.0,
+                 resolve_guild: Optional[Callable[[Any], Optional[int]]] = None):
+        self.db_client = db_client
+        self.on_change = on_change
+        self.resolve_guild = resolve_guild
+        self.poll_interval = poll_interval
+        self.poll_overlap = timedelta(seconds=poll_overlap)
+        self.mode = "starting"
+        self.updates_applied = 0
+        self.ready = asyncio.Event()
+        self._versions: Dict[int, int] = {}
+        self._guild_ids: Dict[Any, int] = {}
+        self._resume_token = None
+        self._last_seen: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def wait_ready(self, timeout: float = 5.0) -> bool:
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Config watcher not ready after {timeout}s, continuing without it.")
+            return False
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                await self._watch()
+                backoff = 1.0
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAMS_UNSUPPORTED_CODES or 'replica set' in str(e).lower():
+                    logger.info(f"Change streams unavailable ({e.code}), falling back to polling guild_config every {self.poll_interval}s.")
+                    await self._poll_forever()
+                    return
+                logger.warning(f"Config change stream failed ({e.code}): {e}. Reconnecting in {backoff:.0f}s.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Config change stream error ({type(e).__name__}): {e}. Reconnecting in {backoff:.0f}s.")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    async def _watch(self):
+        pipeline = [{'$match': {'operationType': {'$in': ['insert', 'update', 'replace', 'delete']}}}]
+        kwargs = {'full_document': 'updateLookup'}
+        if self._resume_token is not None:
+            kwargs['resume_after'] = self._resume_token
+
+        async with self.db_client.config_col.watch(pipeline, **kwargs) as stream:
+            self.mode = "change_stream"
+            self.ready.set()
+            logger.info("Watching guild_config via change stream.")
+            async for change in stream:
+                self._resume_token = stream.resume_token
+                self._handle_change(change)
+
+    def _handle_change(self, change: Dict[str, Any]):
+        if change['operationType'] == 'delete':
+            doc_id = change['documentKey']['_id']
+            guild_id = self._guild_ids.pop(doc_id, None)
+            if guild_id is None and self.resolve_guild is not None:
+                guild_id = self.resolve_guild(doc_id)
+            if guild_id is not None:
+                self._versions.pop(guild_id, None)
+                self._notify(guild_id, None)
+            return
+
+        doc = change.get('fullDocument')
+        if doc:
+            self._apply_document(doc)
+
+    def _apply_document(self, doc: Dict[str, Any]):
+        guild_id = doc.get('guild_id')
+        if not guild_id:
+            return
+        self._guild_ids[doc['_id']] = guild_id
+
+        version = doc.get('version', 0)
+        if version and version <= self._versions.get(guild_id, 0):
+            return
+        self._versions[guild_id] = version
+        self._notify(guild_id, doc)
+
+    def _notify(self, guild_id: int, doc: Optional[Dict[str, Any]]):
+        self.updates_applied += 1
+        try:
+            self.on_change(guild_id, doc)
+            logger.debug(f"Applied config change for guild {guild_id} ({'deleted' if doc is None else 'v' + str(doc.get('version', 0))}).")
+        except Exception as e:
+            logger.exception(f"Error applying config change for guild {guild_id}: {e}")
+
+    async def _poll_forever(self):
+        self.mode = "polling"
+        try:
+            await self.db_client.schema.ensure('guild_config')
+        except Exception as e:
+            logger.warning(f"Could not create updated_at index for config polling: {e}")
+        try:
+            await self._seed_last_seen()
+        except Exception as e:
+            logger.warning(f"Could not read the latest guild_config update time, the first poll will scan all configs: {e}")
+        self.ready.set()
+
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self._poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Config poll failed ({type(e).__name__}): {e}")
+
+    def _observe(self, updated_at: Any):
+        if isinstance(updated_at, datetime):
+            updated_at = updated_at.replace(tzinfo=None)
+            if self._last_seen is None or updated_at > self._last_seen:
+                self._last_seen = updated_at
+
+    async def _seed_last_seen(self):
+        doc = await self.db_client.config_col.find_one({'updated_at': {'$type': 'date'}}, {'updated_at': 1}, sort=[('updated_at', -1)])
+        if doc:
+            self._observe(doc.get('updated_at'))
+
+    async def _poll_once(self):
+        query = {'updated_at': {'$gt': self._last_seen - self.poll_overlap}} if self._last_seen is not None else {}
+        cursor = self.db_client.config_col.find(query, CONFIG_PROJECTION)
+        async for doc in cursor:
+            self._observe(doc.get('updated_at'))
+            self._apply_document(doc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'mode': self.mode, 'updates_applied': self.updates_applied, 'tracked_guilds': len(self._versions)}
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
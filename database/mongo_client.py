@@ -1,10 +1,212 @@
 import os
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import Any, Dict, List, Optional, Tuple
 import logging
 
+from database.schema import IndexSpec, SchemaManager
+from utils.metrics import MONGO_LATENCY
+
 logger = logging.getLogger(__name__)
 
+CONFIG_PROJECTION = {'_id': 1, 'guild_id': 1, 'is_restricted': 1, 'allowed_channels': 1, 'settings': 1, 'version': 1, 'updated_at': 1}
+
+CLIENT_OPTIONS = (
+    ("MONGO_MAX_POOL_SIZE", 'maxPoolSize', int),
+    ("MONGO_MIN_POOL_SIZE", 'minPoolSize', int),
+    ("MONGO_MAX_IDLE_TIME_MS", 'maxIdleTimeMS', int),
+    ("MONGO_MAX_CONNECTING", 'maxConnecting', int),
+    ("MONGO_WAIT_QUEUE_TIMEOUT_MS", 'waitQueueTimeoutMS', int),
+    ("MONGO_CONNECT_TIMEOUT_MS", 'connectTimeoutMS', int),
+    ("MONGO_SOCKET_TIMEOUT_MS", 'socketTimeoutMS', int),
+    ("MONGO_TIMEOUT_MS", 'timeoutMS', int),
+    ("MONGO_READ_PREFERENCE", 'readPreference', str),
+    ("MONGO_APP_NAME", 'appname', str),
+)
+
+def client_options_from_env() -> Dict[str, Any]:
+    options: Dict[str, Any] = {'serverSelectionTimeoutMS': int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))}
+    for env_name, option, cast in CLIENT_OPTIONS:
+        value = os.getenv(env_name)
+        if value:
+            options[option] = cast(value)
+    return options
+
+class PendingUpdate:
+    __slots__ = ('collection', 'filter', 'set_fields', 'inc_fields', 'current_date', 'upsert')
+
+    def __init__(self, collection: str, filter: Dict[str, Any], upsert: bool = True):
+        self.collection = collection
+        self.filter = filter
+        self.set_fields: Dict[str, Any] = {}
+        self.inc_fields: Dict[str, Any] = {}
+        self.current_date: Dict[str, Any] = {}
+        self.upsert = upsert
+
+    def add(self, set_fields: Optional[Dict[str, Any]] = None, inc_fields: Optional[Dict[str, Any]] = None, current_date: Optional[Dict[str, Any]] = None):
+        self.set_fields.update(set_fields or {})
+        for field, amount in (inc_fields or {}).items():
+            self.inc_fields[field] = self.inc_fields.get(field, 0) + amount
+        self.current_date.update(current_date or {})
+
+    def merge_older(self, older: "PendingUpdate"):
+        self.set_fields = {**older.set_fields, **self.set_fields}
+        for field, amount in older.inc_fields.items():
+            self.inc_fields[field] = self.inc_fields.get(field, 0) + amount
+        self.current_date = {**older.current_date, **self.current_date}
+        self.upsert = self.upsert or older.upsert
+
+    def to_operation(self) -> UpdateOne:
+        update = {}
+        if self.set_fields:
+            update['$set'] = self.set_fields
+        if self.inc_fields:
+            update['$inc'] = self.inc_fields
+        if self.current_date:
+            update['$currentDate'] = self.current_date
+        return UpdateOne(self.filter, update, upsert=self.upsert)
+
+
+class WriteBehindQueue:
+    def __init__(self, db, flush_interval: float = 1.0, max_batch: int = 500, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.queued = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self._pending: Dict[Tuple[str, Tuple], PendingUpdate] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _key(collection: str, filter: Dict[str, Any]) -> Tuple[str, Tuple]:
+        return (collection, tuple(sorted(filter.items())))
+
+    def update(self, collection: str, filter: Dict[str, Any], set_fields: Optional[Dict[str, Any]] = None,
+               inc_fields: Optional[Dict[str, Any]] = None, current_date: Optional[Dict[str, Any]] = None, upsert: bool = True):
+        key = self._key(collection, filter)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = PendingUpdate(collection, filter, upsert)
+        else:
+            self.coalesced += 1
+        pending.add(set_fields, inc_fields, current_date)
+        self.queued += 1
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    async def _run(self):
+        backoff = self.base_backoff
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if await self.flush():
+                backoff = self.base_backoff
+                continue
+            delay = backoff * random.uniform(0.8, 1.2)
+            logger.warning(f"Write-behind flush failed, retrying {len(self._pending)} pending update(s) in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            pending, self._pending = self._pending, {}
+            by_collection: Dict[str, List[Tuple[Tuple[str, Tuple], PendingUpdate]]] = {}
+            for key, update in pending.items():
+                by_collection.setdefault(update.collection, []).append((key, update))
+
+            ok = True
+            for collection, items in by_collection.items():
+                for start in range(0, len(items), self.max_batch):
+                    chunk = items[start:start + self.max_batch]
+                    if not await self._write_chunk(collection, chunk):
+                        ok = False
+            return ok
+
+    async def flush_key(self, collection: str, filter: Dict[str, Any]) -> bool:
+        key = self._key(collection, filter)
+        async with self._flush_lock:
+            update = self._pending.pop(key, None)
+            if update is None:
+                return True
+            dropped = self.dropped
+            return await self._write_chunk(collection, [(key, update)]) and self.dropped == dropped
+
+    async def _write_chunk(self, collection: str, chunk: List[Tuple[Tuple[str, Tuple], PendingUpdate]]) -> bool:
+        self.batches += 1
+        try:
+            with MONGO_LATENCY.time(operation=f"write_behind:{collection}"):
+                await self.db[collection].bulk_write([update.to_operation() for _, update in chunk], ordered=False)
+            self.flushed += len(chunk)
+            return True
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            self.flushed += len(chunk) - len(errors)
+            self.dropped += len(errors)
+            for error in errors:
+                logger.error(f"Dropping write-behind update to {collection} {chunk[error['index']][1].filter}: {error.get('errmsg')}")
+            return True
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Write-behind bulk_write to {collection} failed for {len(chunk)} update(s): {e}")
+            for key, update in chunk:
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = update
+                else:
+                    newer.merge_older(update)
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pending': len(self._pending),
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failures': self.failures,
+            'dropped': self.dropped,
+        }
+
+    async def close(self, attempts: int = 3):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for attempt in range(attempts):
+            if await self.flush():
+                return
+            await asyncio.sleep(self.base_backoff * (attempt + 1))
+        if self._pending:
+            logger.error(f"Discarding {len(self._pending)} write-behind update(s) that could not be flushed on shutdown.")
+
+
 class MongoDBClient:
     _instance = None
 
@@ -28,11 +230,27 @@ class MongoDBClient:
             raise ValueError("MONGO_URI was not provided to MongoDBClient constructor.")
 
         try:
-            self.client = AsyncIOMotorClient(uri, serverSelectionTimeoutMS=5000) 
+            options = client_options_from_env()
+            self.client = AsyncIOMotorClient(uri, **options)
 
-            logger.info("Motor AsyncIOMotorClient created.")
+            logger.info(f"Motor AsyncIOMotorClient created ({', '.join(f'{name}={value}' for name, value in options.items())}).")
             self.db = self.client['scriptly_db']
             self.config_col = self.db['guild_config']
+            self.cache_col = self.db['response_cache']
+            self.conversation_col = self.db['conversations']
+            self.instruction_profiles_col = self.db['instruction_profiles']
+            self.usage_col = self.db['guild_usage']
+            self.similar_col = self.db['similar_questions']
+            self.schema = SchemaManager(
+                self.db,
+                force=os.getenv("MONGO_SCHEMA_FORCE", "false").lower() in ("1", "true", "yes"),
+                dedupe_guild_config=os.getenv("MONGO_DEDUPE_GUILD_CONFIG", "false").lower() in ("1", "true", "yes")
+            )
+            self.writes = WriteBehindQueue(
+                self.db,
+                flush_interval=float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "1")),
+                max_batch=int(os.getenv("DB_WRITE_MAX_BATCH", "500"))
+            )
             self._initialized = True 
             logger.info("MongoDB Client Initialized successfully.")
         except Exception as e:
@@ -42,49 +260,190 @@ class MongoDBClient:
             raise ConnectionError(f"Failed to connect to MongoDB: {e}") from e
 
 
-    async def load_all_configs(self) -> Dict[int, Optional[List[int]]]:
+    @staticmethod
+    def parse_channels(doc: Dict[str, Any]) -> Optional[List[int]]:
+        if not doc.get('is_restricted', False):
+            return None
+        allowed_channels_db = doc.get('allowed_channels')
+        return allowed_channels_db if isinstance(allowed_channels_db, list) else []
+
+    async def load_configs(self, guild_ids: List[int]) -> Dict[int, Dict[str, Any]]:
         if not self._initialized:
              logger.error("Attempted to load configs while DB client not initialized.")
              return {}
+        if not guild_ids:
+            return {}
         configs = {}
-        try:
-            cursor = self.config_col.find({})
+        with MONGO_LATENCY.time(operation="load_configs"):
+            cursor = self.config_col.find({'guild_id': {'$in': guild_ids}}, CONFIG_PROJECTION)
             async for doc in cursor:
                 guild_id = doc.get('guild_id')
                 if guild_id:
-                    is_restricted = doc.get('is_restricted', False)
-                    allowed_channels_db = doc.get('allowed_channels')
-                    if is_restricted:
-                        configs[guild_id] = allowed_channels_db if isinstance(allowed_channels_db, list) else []
-                    else:
-                        configs[guild_id] = None
-            count = len(configs)
-            logger.info(f"MongoDB: Loaded configs for {count} guild(s).")
-            return configs
-        except Exception as e:
-            logger.exception(f"Error loading guild configs from MongoDB: {e}")
-            return {} 
+                    configs[guild_id] = doc
+        logger.debug(f"MongoDB: Loaded configs for {len(configs)} of {len(guild_ids)} requested guild(s).")
+        return configs
 
-    async def save_config(self, guild_id: int, is_restricted: bool, channels: Optional[List[int]]):
+    async def save_config(self, guild_id: int, is_restricted: bool, channels: Optional[List[int]], settings: Optional[Dict[str, Any]] = None, wait: bool = True) -> bool:
          if not self._initialized:
              logger.error("Attempted to save config while DB client not initialized.")
+             return False
+         channels_to_save = channels if is_restricted else []
+         update_fields = {
+             'guild_id': guild_id,
+             'is_restricted': is_restricted,
+             'allowed_channels': channels_to_save
+         }
+         for key, value in (settings or {}).items():
+             update_fields[f'settings.{key}'] = value
+
+         self.writes.update(
+             'guild_config',
+             {'guild_id': guild_id},
+             set_fields=update_fields,
+             inc_fields={'version': 1},
+             current_date={'updated_at': True}
+         )
+         if not wait:
+             logger.info(f"Queued config save for guild {guild_id}. Restricted: {is_restricted}, Channels: {channels_to_save if is_restricted else 'N/A'}")
+             return True
+         saved = await self.writes.flush_key('guild_config', {'guild_id': guild_id})
+         if saved:
+             logger.info(f"Saved config for guild {guild_id}. Restricted: {is_restricted}, Channels: {channels_to_save if is_restricted else 'N/A'}")
+         else:
+             logger.error(f"Config save for guild {guild_id} was not confirmed by MongoDB, it stays queued for retry.")
+         return saved
+
+    def increment_guild_counters(self, guild_id: int, counters: Dict[str, int], collection: str = 'guild_config'):
+        if not self._initialized or not counters:
+            return
+        self.writes.update(collection, {'guild_id': guild_id}, inc_fields=counters)
+
+    async def ensure_response_cache_indexes(self):
+        if not self._initialized:
+             logger.error("Attempted to create cache indexes while DB client not initialized.")
              return
-         try:
-            channels_to_save = channels if is_restricted else []
-
-            await self.config_col.update_one(
-                {'guild_id': guild_id},
-                {'$set': {
-                    'guild_id': guild_id,
-                    'is_restricted': is_restricted,
-                    'allowed_channels': channels_to_save 
-                    }
-                },
-                upsert=True
-            )
-            logger.info(f"Saved config for guild {guild_id}. Restricted: {is_restricted}, Channels: {channels_to_save if is_restricted else 'N/A'}")
-         except Exception as e:
-            logger.exception(f"Error saving config for guild {guild_id} to MongoDB: {e}")
+        if await self.schema.ensure('response_cache'):
+            logger.info("MongoDB: Response cache indexes ensured.")
+
+    async def get_cached_response(self, key: str) -> Optional[str]:
+        if not self._initialized:
+             return None
+        try:
+            with MONGO_LATENCY.time(operation="get_cached_response"):
+                doc = await self.cache_col.find_one(
+                    {'key': key, 'expires_at': {'$gt': datetime.now(timezone.utc)}},
+                    {'response': 1, '_id': 0}
+                )
+            return doc.get('response') if doc else None
+        except Exception as e:
+            logger.error(f"Error reading cached response from MongoDB: {e}")
+            return None
+
+    async def set_cached_response(self, key: str, response: str, ttl_seconds: int):
+        if not self._initialized:
+             return
+        try:
+            with MONGO_LATENCY.time(operation="set_cached_response"):
+                await self.cache_col.update_one(
+                    {'key': key},
+                    {'$set': {
+                        'key': key,
+                        'response': response,
+                        'expires_at': datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+                        }
+                    },
+                    upsert=True
+                )
+        except Exception as e:
+            logger.error(f"Error writing cached response to MongoDB: {e}")
+
+
+    async def ensure_usage_indexes(self):
+        if not self._initialized:
+             logger.error("Attempted to create usage indexes while DB client not initialized.")
+             return
+        if await self.schema.ensure('guild_usage'):
+            logger.info("MongoDB: Usage indexes ensured.")
+
+    async def load_usage(self, guild_id: int, day: str) -> Optional[Dict[str, Any]]:
+        if not self._initialized:
+             return None
+        with MONGO_LATENCY.time(operation="load_usage"):
+            return await self.usage_col.find_one({'guild_id': guild_id, 'day': day}, {'_id': 0, 'input_tokens': 1, 'output_tokens': 1, 'requests': 1})
+
+    async def flush_usage(self, guild_id: int, day: str) -> bool:
+        if not self._initialized:
+            return False
+        return await self.writes.flush_key('guild_usage', {'guild_id': guild_id, 'day': day})
+
+    def record_usage(self, guild_id: int, day: str, input_tokens: int, output_tokens: int):
+        if not self._initialized:
+            return
+        counters = {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'requests': 1}
+        for period in (day, 'total'):
+            self.writes.update('guild_usage', {'guild_id': guild_id, 'day': period}, inc_fields=counters, current_date={'updated_at': True})
+
+    async def ensure_similar_question_indexes(self):
+        if not self._initialized:
+             logger.error("Attempted to create similar question indexes while DB client not initialized.")
+             return
+        if await self.schema.ensure('similar_questions'):
+            logger.info("MongoDB: Similar question indexes ensured.")
+
+    def save_similar_question(self, scope: str, question: str, version: str, signature: bytes, answer: str, ttl_seconds: int):
+        if not self._initialized:
+            return
+        now = datetime.now(timezone.utc)
+        self.writes.update(
+            'similar_questions',
+            {'scope': scope, 'question': question},
+            set_fields={'version': version, 'signature': signature, 'answer': answer, 'created_at': now, 'expires_at': now + timedelta(seconds=ttl_seconds)}
+        )
+
+    async def load_similar_questions(self, version: str, limit: int) -> List[Dict[str, Any]]:
+        if not self._initialized:
+             return []
+        with MONGO_LATENCY.time(operation="load_similar_questions"):
+            cursor = self.similar_col.find(
+                {'version': version, 'expires_at': {'$gt': datetime.now(timezone.utc)}},
+                {'_id': 0, 'scope': 1, 'question': 1, 'signature': 1, 'answer': 1, 'expires_at': 1}
+            ).sort('created_at', -1).limit(limit)
+            return await cursor.to_list(length=limit)
+
+    async def load_instruction_profile(self, name: str) -> Optional[Dict[str, Any]]:
+        if not self._initialized:
+             return None
+        with MONGO_LATENCY.time(operation="load_instruction_profile"):
+            return await self.instruction_profiles_col.find_one({'_id': name}, {'instructions': 1, 'mode': 1})
+
+
+    async def ensure_conversation_indexes(self, ttl_seconds: int):
+        if not self._initialized:
+             logger.error("Attempted to create conversation indexes while DB client not initialized.")
+             return
+        ttl_index = IndexSpec('conversations', [('updated_at', 1)], expireAfterSeconds=ttl_seconds)
+        if await self.schema.ensure('conversations') and await self.schema.ensure_index(ttl_index):
+            logger.info("MongoDB: Conversation indexes ensured.")
+
+    async def load_conversation(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self._initialized:
+             return None
+        try:
+            with MONGO_LATENCY.time(operation="load_conversation"):
+                return await self.conversation_col.find_one({'key': key}, {'_id': 0})
+        except Exception as e:
+            logger.error(f"Error loading conversation {key} from MongoDB: {e}")
+            return None
+
+    def save_conversation(self, document: Dict[str, Any]):
+        if not self._initialized:
+             return
+        self.writes.update('conversations', {'key': document['key']}, set_fields=document)
+
+    async def close(self):
+        if self._initialized:
+            await self.writes.close()
+        self.client.close()
 
 
 _db_client_instance: Optional[MongoDBClient] = None
@@ -103,6 +462,8 @@ async def get_db_client() -> MongoDBClient:
             _db_client_instance = MongoDBClient(uri=mongo_uri_from_env)
             await _db_client_instance.client.admin.command('ping')
             logger.info("MongoDB connection confirmed with ping.")
+            await _db_client_instance.schema.apply()
+            _db_client_instance.writes.start()
         except ConnectionError as ce:
              logger.critical(f"MongoDB connection failed during initial ping check: {ce}", exc_info=True)
              _db_client_instance = None
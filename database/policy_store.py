@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set
+
+from database.mongo_client import MongoDBClient
+
+logger = logging.getLogger(__name__)
+
+class GuildPolicy:
+    __slots__ = ('guild_id', 'allowed_channels', 'settings', 'version', 'doc_id')
+
+    def __init__(self, guild_id: int, allowed_channels: Optional[Iterable[int]] = None, settings: Optional[Dict[str, Any]] = None, version: int = 0, doc_id: Any = None):
+        self.guild_id = guild_id
+        self.allowed_channels: Optional[FrozenSet[int]] = frozenset(allowed_channels) if allowed_channels is not None else None
+        self.settings = settings or {}
+        self.version = version
+        self.doc_id = doc_id
+
+    @property
+    def is_restricted(self) -> bool:
+        return self.allowed_channels is not None
+
+    def allows(self, channel_id: int) -> bool:
+        return self.allowed_channels is None or channel_id in self.allowed_channels
+
+    def replace(self, allowed_channels: Optional[Iterable[int]], settings: Optional[Dict[str, Any]] = None) -> "GuildPolicy":
+        merged_settings = dict(self.settings)
+        merged_settings.update(settings or {})
+        return GuildPolicy(self.guild_id, allowed_channels, merged_settings, self.version + 1, self.doc_id)
+
+    @classmethod
+    def from_document(cls, guild_id: int, doc: Optional[Dict[str, Any]]) -> "GuildPolicy":
+        if not doc:
+            return cls(guild_id)
+        settings = doc.get('settings')
+        return cls(
+            guild_id,
+            MongoDBClient.parse_channels(doc),
+            settings if isinstance(settings, dict) else {},
+            doc.get('version', 0) or 0,
+            doc.get('_id')
+        )
+
+
+class GuildPolicyStore:
+    def __init__(self, db_client=None, max_size: int = 5000, batch_window: float = 0.005, max_batch: int = 100):
+        self.db_client = db_client
+        self.max_size = max_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self._policies: "OrderedDict[int, GuildPolicy]" = OrderedDict()
+        self._doc_ids: Dict[Any, int] = {}
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._batch: List[int] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._policies)
+
+    def peek(self, guild_id: int) -> Optional[GuildPolicy]:
+        return self._policies.get(guild_id)
+
+    async def get(self, guild_id: int) -> GuildPolicy:
+        policy = self._policies.get(guild_id)
+        if policy is not None:
+            self.hits += 1
+            self._policies.move_to_end(guild_id)
+            return policy
+
+        self.misses += 1
+        future = self._pending.get(guild_id)
+        if future is None:
+            future = self._enqueue(guild_id)
+        return await asyncio.shield(future)
+
+    def _enqueue(self, guild_id: int) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[guild_id] = future
+        self._batch.append(guild_id)
+        if len(self._batch) >= self.max_batch:
+            self._schedule_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._schedule_flush)
+        return future
+
+    def _schedule_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch:
+            return
+        guild_ids, self._batch = self._batch, []
+        task = asyncio.create_task(self._load(guild_ids))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _load(self, guild_ids: List[int]):
+        self.batches += 1
+        try:
+            docs = await self.db_client.load_configs(guild_ids) if self.db_client else {}
+            cacheable = True
+        except Exception as e:
+            logger.error(f"Failed to load policies for {len(guild_ids)} guild(s), using defaults: {e}")
+            docs, cacheable = {}, False
+
+        for guild_id in guild_ids:
+            loaded = GuildPolicy.from_document(guild_id, docs.get(guild_id))
+            current = self._policies.get(guild_id)
+            if current is not None and current.version >= loaded.version:
+                policy = current
+            else:
+                policy = loaded
+                if cacheable:
+                    self._store(policy)
+            future = self._pending.pop(guild_id, None)
+            if future is not None and not future.done():
+                future.set_result(policy)
+
+    def _store(self, policy: GuildPolicy):
+        previous = self._policies.get(policy.guild_id)
+        if previous is not None and previous.doc_id != policy.doc_id:
+            self._doc_ids.pop(previous.doc_id, None)
+        if policy.doc_id is not None:
+            self._doc_ids[policy.doc_id] = policy.guild_id
+        self._policies[policy.guild_id] = policy
+        self._policies.move_to_end(policy.guild_id)
+        while len(self._policies) > self.max_size:
+            self._doc_ids.pop(self._policies.popitem(last=False)[1].doc_id, None)
+
+    def _remove(self, guild_id: int):
+        policy = self._policies.pop(guild_id, None)
+        if policy is not None:
+            self._doc_ids.pop(policy.doc_id, None)
+
+    def guild_for_document(self, doc_id: Any) -> Optional[int]:
+        return self._doc_ids.get(doc_id)
+
+    def put(self, policy: GuildPolicy):
+        self._store(policy)
+
+    def apply_change(self, guild_id: int, doc: Optional[Dict[str, Any]]):
+        if guild_id not in self._policies and guild_id not in self._pending:
+            return
+        if doc is None:
+            self._remove(guild_id)
+            return
+        policy = GuildPolicy.from_document(guild_id, doc)
+        current = self._policies.get(guild_id)
+        if current is None or policy.version == 0 or policy.version >= current.version:
+            self._store(policy)
+
+    async def prewarm(self, guild_ids: Iterable[int], limit: int = 1000):
+        missing = [guild_id for guild_id in guild_ids if guild_id not in self._policies and guild_id not in self._pending][:limit]
+        if not missing:
+            return
+        for start in range(0, len(missing), self.max_batch):
+            await self._load(missing[start:start + self.max_batch])
+        logger.info(f"Prewarmed policies for {len(missing)} guild(s).")
+
+    def stats(self) -> Dict[str, int]:
+        return {'cached': len(self._policies), 'hits': self.hits, 'misses': self.misses, 'batches': self.batches}
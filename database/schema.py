@@ -0,0 +1,207 @@
+import time
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+SCHEMA_COLLECTION = 'schema_meta'
+DUPLICATES_BACKUP_COLLECTION = 'guild_config_duplicates'
+INDEX_CONFLICT_CODES = {85, 86}
+
+
+class IndexSpec:
+    __slots__ = ('collection', 'keys', 'options')
+
+    def __init__(self, collection: str, keys: Sequence[Tuple[str, int]], **options):
+        self.collection = collection
+        self.keys = list(keys)
+        self.options = options
+
+    @property
+    def name(self) -> str:
+        return self.options.get('name') or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+    def describe(self) -> str:
+        return f"{self.collection}.{self.name}"
+
+
+INDEXES: List[IndexSpec] = [
+    IndexSpec('guild_config', [('guild_id', 1)], unique=True),
+    IndexSpec('guild_config', [('updated_at', 1)]),
+    IndexSpec('response_cache', [('key', 1)], unique=True),
+    IndexSpec('response_cache', [('expires_at', 1)], expireAfterSeconds=0),
+    IndexSpec('conversations', [('key', 1)], unique=True),
+    IndexSpec('guild_usage', [('guild_id', 1), ('day', 1)], unique=True),
+    IndexSpec('similar_questions', [('scope', 1), ('question', 1)], unique=True),
+    IndexSpec('similar_questions', [('version', 1), ('created_at', -1)]),
+    IndexSpec('similar_questions', [('expires_at', 1)], expireAfterSeconds=0),
+]
+
+
+class SchemaManager:
+    def __init__(self, db, indexes: Sequence[IndexSpec] = INDEXES, version: int = SCHEMA_VERSION, force: bool = False, dedupe_guild_config: bool = False):
+        self.db = db
+        self.indexes = list(indexes)
+        self.version = version
+        self.force = force
+        self.dedupe_guild_config = dedupe_guild_config
+        self.applied_version: Optional[int] = None
+        self.ensured = 0
+        self.updated = 0
+        self.failed = 0
+        self.duplicates_removed = 0
+        self.duplicate_guilds = 0
+        self._ensured: Set[str] = set()
+        self._skipped: Set[str] = set()
+
+    async def current_version(self) -> int:
+        doc = await self.db[SCHEMA_COLLECTION].find_one({'_id': 'schema'}, {'version': 1})
+        return (doc or {}).get('version', 0)
+
+    async def apply(self) -> bool:
+        try:
+            current = await self.current_version()
+        except Exception as e:
+            logger.error(f"Could not read the MongoDB schema version, skipping index management: {e}")
+            return False
+
+        if current > self.version:
+            logger.warning(f"MongoDB schema is at version {current}, newer than this build's {self.version}. Leaving indexes as they are.")
+        if current >= self.version and not self.force:
+            self.applied_version = current
+            self._ensured.update(spec.collection for spec in self.indexes)
+            logger.info(f"MongoDB schema is at version {current}, indexes up to date.")
+            return True
+
+        started = time.perf_counter()
+        if self.dedupe_guild_config:
+            await self.remove_duplicate_guild_configs()
+        duplicates = await self.find_duplicate_guild_configs()
+        if duplicates:
+            self._skipped.add('guild_config.guild_id_1')
+            logger.error(
+                f"guild_config has {self.duplicate_guilds} guild(s) with duplicate documents (e.g. {', '.join(map(str, duplicates))}); "
+                f"skipping the unique guild_id index. Merge them by hand or restart once with MONGO_DEDUPE_GUILD_CONFIG=true "
+                f"(keeps the newest document per guild, backs the others up to {DUPLICATES_BACKUP_COLLECTION})."
+            )
+        ok = True
+        for collection in dict.fromkeys(spec.collection for spec in self.indexes):
+            ok = await self.ensure(collection, force=True) and ok
+        if not ok or self._skipped:
+            logger.error(f"MongoDB schema migration to version {self.version} incomplete ({self.failed} index(es) failed, {len(self._skipped)} skipped), will retry on next start.")
+            return False
+
+        try:
+            await self.db[SCHEMA_COLLECTION].update_one(
+                {'_id': 'schema'},
+                {'$set': {
+                    'version': self.version,
+                    'indexes': [spec.describe() for spec in self.indexes],
+                    'applied_at': datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Indexes are in place but the schema version could not be recorded, will retry on next start: {e}")
+            return False
+        self.applied_version = self.version
+        logger.info(f"MongoDB schema migrated from version {current} to {self.version} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+        return True
+
+    async def ensure(self, collection: str, force: bool = False) -> bool:
+        if collection in self._ensured and not force:
+            return True
+        ok = True
+        for spec in self.indexes:
+            if spec.collection == collection and spec.describe() not in self._skipped:
+                ok = await self.ensure_index(spec) and ok
+        if ok:
+            self._ensured.add(collection)
+        return ok
+
+    async def ensure_index(self, spec: IndexSpec) -> bool:
+        options = {**spec.options, 'name': spec.name}
+        try:
+            await self.db[spec.collection].create_index(spec.keys, **options)
+            self.ensured += 1
+            return True
+        except OperationFailure as e:
+            if e.code in INDEX_CONFLICT_CODES and 'expireAfterSeconds' in spec.options:
+                return await self._update_ttl(spec)
+            self.failed += 1
+            if e.code == 11000:
+                logger.error(f"Cannot create unique index {spec.describe()}: the collection has duplicate keys ({e.details.get('errmsg') if e.details else e}).")
+            else:
+                logger.error(f"Error creating index {spec.describe()} ({e.code}): {e}")
+            return False
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Error creating index {spec.describe()}: {e}")
+            return False
+
+    async def _update_ttl(self, spec: IndexSpec) -> bool:
+        try:
+            await self.db.command('collMod', spec.collection, index={'keyPattern': dict(spec.keys), 'expireAfterSeconds': spec.options['expireAfterSeconds']})
+            self.updated += 1
+            logger.info(f"Updated TTL of {spec.describe()} to {spec.options['expireAfterSeconds']}s.")
+            return True
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Could not update TTL of {spec.describe()}: {e}")
+            return False
+
+    async def find_duplicate_guild_configs(self, sample: int = 10) -> List[Any]:
+        pipeline = [
+            {'$group': {'_id': '$guild_id', 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ]
+        guild_ids = []
+        self.duplicate_guilds = 0
+        try:
+            async for group in self.db['guild_config'].aggregate(pipeline, allowDiskUse=True):
+                self.duplicate_guilds += 1
+                if len(guild_ids) < sample:
+                    guild_ids.append(group['_id'])
+        except Exception as e:
+            logger.error(f"Could not check guild_config for duplicate guild documents: {e}")
+            return []
+        return guild_ids
+
+    async def remove_duplicate_guild_configs(self) -> int:
+        collection = self.db['guild_config']
+        pipeline = [
+            {'$sort': {'version': -1, 'updated_at': -1, '_id': -1}},
+            {'$group': {'_id': '$guild_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}}
+        ]
+        stale = []
+        try:
+            async for group in collection.aggregate(pipeline, allowDiskUse=True):
+                stale.extend(group['ids'][1:])
+            if not stale:
+                return 0
+            backup = [{**doc, 'backed_up_at': datetime.now(timezone.utc)} async for doc in collection.find({'_id': {'$in': stale}})]
+            await self.db[DUPLICATES_BACKUP_COLLECTION].bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True) for doc in backup], ordered=False)
+            result = await collection.delete_many({'_id': {'$in': stale}})
+        except Exception as e:
+            logger.error(f"Could not remove duplicate guild_config documents, leaving them in place: {e}")
+            return 0
+        self.duplicates_removed += result.deleted_count
+        logger.warning(f"Removed {result.deleted_count} duplicate guild_config document(s), keeping the highest version (then most recently updated) per guild. Backups are in {DUPLICATES_BACKUP_COLLECTION}.")
+        return result.deleted_count
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'version': self.applied_version,
+            'target_version': self.version,
+            'ensured': self.ensured,
+            'updated': self.updated,
+            'failed': self.failed,
+            'duplicates_removed': self.duplicates_removed,
+            'duplicate_guilds': self.duplicate_guilds,
+        }
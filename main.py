@@ -1,48 +1,37 @@
 import os
-import io
+import time
+PROCESS_STARTED = time.perf_counter()
 import asyncio
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 import logging
 import sys
+from typing import Optional, Tuple
 
 from database.mongo_client import get_db_client
-from utils.ai_utils import get_ai_response
+from database.policy_store import GuildPolicyStore
+from database.config_watcher import ConfigWatcher
+from utils.ai_utils import AIResponseError, get_ai_response, stream_ai_response, get_ai_client, close_ai_client, import_genai, summarize_conversation
+from utils.conversation import ConversationContext, ConversationStore
+from utils.instructions import DEFAULT_PROFILE, InstructionProfile, InstructionsManager
+from utils.response_cache import ResponseCache, make_cache_key
+from utils.similarity_index import SimilarityIndex
+from utils.scheduler import FairScheduler, SchedulerBusy
+from utils.singleflight import SingleFlight
+from utils.rate_limit import RateLimiter
+from utils.stream_reply import StreamingReply
+from utils.chunked_reply import send_chunked_reply
+from utils.attachments import AttachmentReader
+from utils.command_sync import CommandSyncState, sync_commands_if_changed
+from utils.load_tracker import LoadTracker
+from utils.token_budget import PromptTooLarge, TokenBudget, TokenUsage, estimate_tokens
+from utils.usage_tracker import UsageTracker
+from utils.log_config import setup_logging, stop_logging, set_request_id
+from utils.metrics import MetricsServer, MENTIONS, RESPONSES, COMMANDS, MENTION_LATENCY, AI_IN_FLIGHT, AI_QUEUE_DEPTH, DEGRADED, configure_guild_buckets, guild_bucket
+from utils.startup_profile import StartupProfiler
 from utils.status_task import update_status_task, cancel_status_task
-
-def setup_logging():
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(log_dir, "scriptly.log")
-    log_level = logging.INFO 
-
-    log_format = logging.Formatter(
-        '%(asctime)s [%(levelname)-8s] %(name)-20s: %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
-    root_logger = logging.getLogger()
-    root_logger.setLevel(log_level)
-
-    try:
-        file_handler = logging.FileHandler(log_file, encoding='utf-8', mode='a')
-        file_handler.setFormatter(log_format)
-        root_logger.addHandler(file_handler)
-    except Exception as e:
-        print(f"Error setting up file logging handler: {e}", file=sys.stderr)
-
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(log_format)
-    root_logger.addHandler(console_handler)
-
-    logging.getLogger("discord.http").setLevel(logging.WARNING)
-    logging.getLogger("discord.gateway").setLevel(logging.WARNING)
-    logging.getLogger("discord.client").setLevel(logging.INFO)
-
-    print(f"Logging setup complete. Level: {logging.getLevelName(log_level)}. Log file: {log_file}")
-    logging.info("-------------------- Bot Start --------------------")
-
+IMPORTS_FINISHED = time.perf_counter()
 
 ASCII_ART = r"""
  ________  ________  ________   ________  ________      ___    ___ 
@@ -57,56 +46,230 @@ Developed by Canary Software
 ----------------------------------
 """
 
+RESPONSE_FOOTER = "\n\n-# Scriptly can make mistakes, don't rely on it."
+
 intents = discord.Intents.default()
 intents.message_content = True  
 intents.guilds = True    
 
 class ScriptlyBot(commands.Bot):
-    def __init__(self):
+    def __init__(self, startup_profile: bool = False):
         super().__init__(command_prefix=";", intents=intents)
-        self.allowed_channels = {}
-        self.usage_count = 0
+        self.startup = StartupProfiler(origin=PROCESS_STARTED)
+        self.startup.record("imports", PROCESS_STARTED, IMPORTS_FINISHED)
+        self.startup_profile = startup_profile
+        self.login_started: Optional[float] = None
+        self._gateway_started: Optional[float] = None
+        self._ai_startup: Optional[asyncio.Task] = None
+        self.policy_store = GuildPolicyStore()
+        self.prewarm_policies = os.getenv("POLICY_PREWARM", "false").lower() in ("1", "true", "yes")
+        self._policies_prewarmed = False
         self.db_client = None
+        self.config_watcher = None
+        self.instructions = None
+        self.ai_client = None
+        self.response_cache = None
+        self.similar_questions = None
+        self.scheduler = None
+        self.single_flight = SingleFlight()
+        self.conversations = None
+        self.metrics_server = None
+        self.rate_limiter = RateLimiter({
+            'user': (float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "6")), int(os.getenv("RATE_LIMIT_USER_BURST", "3"))),
+            'channel': (float(os.getenv("RATE_LIMIT_CHANNEL_PER_MINUTE", "20")), int(os.getenv("RATE_LIMIT_CHANNEL_BURST", "8"))),
+            'guild': (float(os.getenv("RATE_LIMIT_GUILD_PER_MINUTE", "60")), int(os.getenv("RATE_LIMIT_GUILD_BURST", "20"))),
+        })
+        self.load_tracker = LoadTracker(
+            queue_depth=lambda: self.scheduler.queue_depth if self.scheduler else 0,
+            degrade_p95=float(os.getenv("LOAD_DEGRADE_P95_SECONDS", "20")),
+            recover_p95=float(os.getenv("LOAD_RECOVER_P95_SECONDS", "8")),
+            degrade_queue=int(os.getenv("LOAD_DEGRADE_QUEUE_DEPTH", "60")),
+            recover_queue=int(os.getenv("LOAD_RECOVER_QUEUE_DEPTH", "20")),
+            min_dwell=float(os.getenv("LOAD_MIN_DWELL_SECONDS", "30"))
+        )
+        self.degraded_max_output_tokens = int(os.getenv("AI_DEGRADED_MAX_OUTPUT_TOKENS", "512"))
+        self.token_budget = TokenBudget(
+            max_input_tokens=int(os.getenv("AI_MAX_INPUT_TOKENS", "8000")),
+            mode=os.getenv("AI_INPUT_OVERFLOW", "truncate").lower(),
+            default_max_output_tokens=int(os.getenv("AI_MAX_OUTPUT_TOKENS", "0"))
+        )
+        self.usage = UsageTracker(daily_token_cap=int(os.getenv("USAGE_DAILY_TOKEN_CAP", "0")))
+        self.stream_responses = os.getenv("AI_STREAM_RESPONSES", "false").lower() in ("1", "true", "yes")
+        self.stream_edit_interval = int(os.getenv("AI_STREAM_EDIT_INTERVAL_MS", "1200")) / 1000
+        self.reply_file_threshold = int(os.getenv("AI_REPLY_FILE_THRESHOLD", "10000"))
+        self.attachments = None
+        if os.getenv("ATTACHMENTS_ENABLED", "true").lower() in ("1", "true", "yes"):
+            self.attachments = AttachmentReader(
+                extensions=[ext.strip() for ext in os.getenv("ATTACHMENT_EXTENSIONS", ".lua,.luau,.txt").split(",") if ext.strip()],
+                max_files=int(os.getenv("ATTACHMENT_MAX_FILES", "3")),
+                max_bytes=int(os.getenv("ATTACHMENT_MAX_BYTES", "4194304")),
+                max_chars=int(os.getenv("ATTACHMENT_MAX_CHARS", "12000")),
+                context_lines=int(os.getenv("ATTACHMENT_CONTEXT_LINES", "15")),
+                max_concurrency=int(os.getenv("ATTACHMENT_MAX_CONCURRENCY", "4")),
+                timeout=float(os.getenv("ATTACHMENT_TIMEOUT", "20"))
+            )
         self.logger = logging.getLogger(self.__class__.__name__)
 
     async def setup_hook(self):
+        setup_started = time.perf_counter()
         self.logger.info("Running setup_hook...")
+        if self.login_started is not None:
+            self.startup.record("discord login", self.login_started, setup_started)
+        self._ai_startup = asyncio.create_task(self.start_ai_client())
+
         try:
-            self.db_client = await get_db_client()
-            self.allowed_channels = await self.db_client.load_all_configs()
-            self.logger.info(f"Loaded configs for {len(self.allowed_channels)} guilds from DB.")
+            with self.startup.phase("db ping"):
+                self.db_client = await get_db_client()
+            config_started = time.perf_counter()
+            self.policy_store = GuildPolicyStore(
+                db_client=self.db_client,
+                max_size=int(os.getenv("POLICY_CACHE_SIZE", "5000"))
+            )
+            self.config_watcher = ConfigWatcher(
+                self.db_client, self.policy_store.apply_change, poll_interval=float(os.getenv("CONFIG_POLL_INTERVAL", "1")),
+                resolve_guild=self.policy_store.guild_for_document
+            )
+            self.config_watcher.start()
+            await self.config_watcher.wait_ready()
+            self.startup.record("config load", config_started)
         except Exception as e:
-            self.logger.exception("CRITICAL: Failed to connect to DB or load initial configs. Check MONGO_URI and DB access.")
+            self.logger.exception("CRITICAL: Failed to connect to DB. Check MONGO_URI and DB access.")
+
+        self.usage = UsageTracker(db_client=self.db_client, daily_token_cap=self.usage.daily_token_cap)
+        await self.usage.setup()
+
+        with self.startup.phase("instructions"):
+            self.instructions = InstructionsManager(
+                path=os.getenv("INSTRUCTIONS_FILE", "instructions.txt"),
+                db_client=self.db_client,
+                poll_interval=float(os.getenv("INSTRUCTIONS_POLL_INTERVAL", "2")),
+                max_profiles=int(os.getenv("INSTRUCTIONS_PROFILE_CACHE_SIZE", "64")),
+                profile_ttl=float(os.getenv("INSTRUCTIONS_PROFILE_TTL", "300"))
+            )
+            await self.instructions.load()
+            self.instructions.start()
+
+        if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+            self.response_cache = ResponseCache(
+                db_client=self.db_client,
+                max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+                ttl=int(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+            )
+            await self.response_cache.setup()
+            self.logger.info(f"Response cache enabled (L2: {'MongoDB' if self.db_client else 'disabled'}).")
+
+            if os.getenv("SIMILAR_CACHE_ENABLED", "true").lower() in ("1", "true", "yes"):
+                self.similar_questions = SimilarityIndex(
+                    db_client=self.db_client,
+                    capacity=int(os.getenv("SIMILAR_CACHE_SIZE", "5000")),
+                    threshold=float(os.getenv("SIMILAR_CACHE_THRESHOLD", "0.8")),
+                    ttl=int(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+                )
+                await self.similar_questions.setup()
+
+        if os.getenv("CONVERSATION_MEMORY_ENABLED", "true").lower() in ("1", "true", "yes"):
+            self.conversations = ConversationStore(
+                db_client=self.db_client,
+                summarizer=summarize_conversation,
+                max_turns=int(os.getenv("CONVERSATION_MAX_TURNS", "12")),
+                token_budget=int(os.getenv("CONVERSATION_TOKEN_BUDGET", "1500")),
+                compact_threshold=int(os.getenv("CONVERSATION_COMPACT_THRESHOLD", "2000")),
+                max_conversations=int(os.getenv("CONVERSATION_CACHE_SIZE", "2000")),
+                ttl_seconds=int(os.getenv("CONVERSATION_TTL_DAYS", "7")) * 86400
+            )
+            await self.conversations.setup()
+            self.logger.info("Conversation memory enabled.")
+
+        self.scheduler = FairScheduler(
+            max_concurrency=int(os.getenv("AI_SCHEDULER_CONCURRENCY", "8")),
+            max_queue_size=int(os.getenv("AI_SCHEDULER_QUEUE_SIZE", "100")),
+            max_per_key=int(os.getenv("AI_SCHEDULER_QUEUE_PER_GUILD", "10"))
+        )
+        self.scheduler.start()
+        AI_QUEUE_DEPTH.set_function(lambda: self.scheduler.queue_depth)
+        DEGRADED.set_function(lambda: int(self.load_tracker.degraded))
 
-        self.logger.info("Loading extensions (cogs)...")
-        commands_dir = "commands"
-        for filename in os.listdir(commands_dir):
-            if filename.endswith(".py") and not filename.startswith("_"):
-                extension_name = f"{commands_dir}.{filename[:-3]}"
-                try:
-                    await self.load_extension(extension_name)
-                    self.logger.info(f"Successfully loaded extension: {extension_name}")
-                except commands.errors.NoEntryPointError:
-                     self.logger.error(f"Extension {extension_name} has no 'async def setup(bot)' function.")
-                except commands.errors.ExtensionNotFound:
-                     self.logger.error(f"Extension {extension_name} could not be found.")
-                except Exception as e:
-                    self.logger.exception(f"Failed to load extension {extension_name}.")
+        if os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes"):
+            configure_guild_buckets(int(os.getenv("METRICS_GUILD_BUCKETS", "16")))
+            self.metrics_server = MetricsServer(host=os.getenv("METRICS_HOST", "127.0.0.1"), port=int(os.getenv("METRICS_PORT", "9108")))
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                self.logger.error(f"Could not start metrics endpoint: {e}")
+                self.metrics_server = None
+
+        with self.startup.phase("cog load"):
+            await self.load_extensions("commands")
 
         self.logger.info("Syncing application (slash) commands...")
+        sync_started = time.perf_counter()
         try:
-            synced = await self.tree.sync()
-            self.logger.info(f"Synced {len(synced)} application command(s) globally.")
+            dev_guild_id = os.getenv("COMMAND_SYNC_GUILD_ID")
+            await sync_commands_if_changed(
+                self.tree,
+                self.application_id,
+                CommandSyncState(os.getenv("COMMAND_SYNC_STATE_FILE", ".command_sync.json")),
+                guild_id=int(dev_guild_id) if dev_guild_id else None,
+                force=os.getenv("COMMAND_SYNC_FORCE", "false").lower() in ("1", "true", "yes")
+            )
         except Exception as e:
             self.logger.exception("Error syncing application commands.")
+        self.startup.record("command sync", sync_started)
 
-        self.logger.info("setup_hook completed.")
+        self._gateway_started = time.perf_counter()
+        self.logger.info(f"setup_hook completed in {self._gateway_started - setup_started:.2f}s.")
+
+
+    async def start_ai_client(self):
+        try:
+            with self.startup.phase("genai import"):
+                await asyncio.to_thread(import_genai)
+            with self.startup.phase("ai client warm-up"):
+                self.ai_client = await get_ai_client()
+            self.logger.info(f"AI client ready (model {self.ai_client.model_name}, max concurrency {self.ai_client.max_concurrency}).")
+            AI_IN_FLIGHT.set_function(lambda: self.ai_client.in_flight)
+            if os.getenv("AI_EXACT_TOKEN_COUNT", "false").lower() in ("1", "true", "yes"):
+                self.token_budget.token_counter = self.ai_client.count_tokens
+        except Exception as e:
+            self.logger.exception("Failed to initialize the AI client. AI responses will fail until it can be created.")
+
+
+    async def load_extensions(self, commands_dir: str):
+        extension_names = sorted(
+            f"{commands_dir}.{filename[:-3]}"
+            for filename in os.listdir(commands_dir)
+            if filename.endswith(".py") and not filename.startswith("_")
+        )
+        self.logger.info(f"Loading {len(extension_names)} extension(s) (cogs)...")
+        started = time.perf_counter()
+        await asyncio.gather(*(self.load_extension_timed(name) for name in extension_names))
+        self.logger.info(f"Loaded extensions in {time.perf_counter() - started:.2f}s.")
+
+
+    async def load_extension_timed(self, extension_name: str):
+        started = time.perf_counter()
+        try:
+            await self.load_extension(extension_name)
+            self.logger.info(f"Successfully loaded extension: {extension_name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+        except commands.errors.NoEntryPointError:
+             self.logger.error(f"Extension {extension_name} has no 'async def setup(bot)' function.")
+        except commands.errors.ExtensionNotFound:
+             self.logger.error(f"Extension {extension_name} could not be found.")
+        except Exception as e:
+            self.logger.exception(f"Failed to load extension {extension_name}.")
 
 
     async def on_ready(self):
         self.logger.info(f'Logged in as {self.user.name} ({self.user.id})')
         self.logger.info(f'Connected to {len(self.guilds)} guilds.')
         self.logger.info('------ Bot is Ready ------')
+        if self._gateway_started is not None:
+            self.startup.record("gateway READY", self._gateway_started)
+            self._gateway_started = None
+            await self.report_startup()
+        if self.prewarm_policies and not self._policies_prewarmed:
+            self._policies_prewarmed = True
+            asyncio.create_task(self.policy_store.prewarm([guild.id for guild in self.guilds], limit=int(os.getenv("POLICY_PREWARM_LIMIT", "1000"))))
         if not update_status_task.is_running():
              try:
                  update_status_task.start(self)
@@ -115,6 +278,17 @@ class ScriptlyBot(commands.Bot):
                  self.logger.error(f"Could not start status task (already running or other issue?): {e}")
 
 
+    async def report_startup(self):
+        self.logger.info(f"Ready {self.startup.elapsed:.2f}s after process start ({self.startup.summary()}).")
+        if not self.startup_profile:
+            return
+        if self._ai_startup is not None and not self._ai_startup.done():
+            await asyncio.wait({self._ai_startup})
+        print(self.startup.report(), flush=True)
+        self.logger.info("Startup profile complete, shutting down.")
+        await self.close()
+
+
     async def on_message(self, message: discord.Message):
         if message.author.bot:
             return
@@ -133,63 +307,310 @@ class ScriptlyBot(commands.Bot):
         if not is_mentioned:
             return
 
-        if is_guild:
-            guild_restrictions = self.allowed_channels.get(message.guild.id)
-            if guild_restrictions is not None and message.channel.id not in guild_restrictions:
-                self.logger.debug(f"Ignoring mention in restricted channel {message.channel.id} in guild {message.guild.id}")
+        started = time.perf_counter()
+        set_request_id(message.id)
+        bucket = guild_bucket(message.guild.id if is_guild else None)
+        MENTIONS.inc(guild_bucket=bucket)
+
+        policy = await self.policy_store.get(message.guild.id) if is_guild else None
+        guild_settings = policy.settings if policy else None
+
+        if policy and not policy.allows(message.channel.id):
+            self.logger.debug(f"Ignoring mention in restricted channel {message.channel.id} in guild {message.guild.id}")
+            self.record_outcome("restricted", bucket, started)
+            if not self.rate_limiter.allow_notice(message.author.id, guild_settings):
+                self.logger.debug(f"Suppressing restriction notice for {message.author.id} (notice rate limit).")
+                return
+            try:
+                await message.reply(f"Sorry, I can only respond in specific channels in this server. Use `{self.command_prefix}scriptly` to see which.", delete_after=15, mention_author=False, allowed_mentions=discord.AllowedMentions.none())
+            except discord.errors.Forbidden:
+                self.logger.warning(f"Cannot send restriction notice in channel {message.channel.id} (Forbidden).")
+            except Exception as e:
+                self.logger.error(f"Error sending restriction notice: {e}")
+            return
+
+        retry_after = self.rate_limiter.check_mention(message.author.id, message.channel.id, message.guild.id if is_guild else None, guild_settings)
+        if retry_after > 0:
+            self.logger.info(f"Rate limited AI mention from {message.author} (retry after {retry_after:.1f}s).")
+            self.record_outcome("rate_limited", bucket, started)
+            if self.rate_limiter.allow_notice(message.author.id, guild_settings):
                 try:
-                    await message.reply(f"Sorry, I can only respond in specific channels in this server. Use `{self.command_prefix}scriptly` to see which.", delete_after=15, mention_author=False, allowed_mentions=discord.AllowedMentions.none())
+                    await message.reply(f"You're sending requests too quickly. Please try again in {max(1, round(retry_after))} seconds.", delete_after=15, mention_author=False, allowed_mentions=discord.AllowedMentions.none())
                 except discord.errors.Forbidden:
-                    self.logger.warning(f"Cannot send restriction notice in channel {message.channel.id} (Forbidden).")
+                    self.logger.warning(f"Cannot send rate limit notice in channel {message.channel.id} (Forbidden).")
                 except Exception as e:
-                    self.logger.error(f"Error sending restriction notice: {e}")
-                return
+                    self.logger.error(f"Error sending rate limit notice: {e}")
+            return
 
-        self.usage_count += 1
-        self.logger.info(f"AI mention detected from {message.author}. Usage count: {self.usage_count}")
+        self.load_tracker.record_request()
+        degraded = self.load_tracker.is_degraded()
+        self.logger.info(f"AI mention detected from {message.author}. Load: {self.load_tracker.requests.rate_per_minute():.0f}/min{' (degraded)' if degraded else ''}")
 
         user_message = message.clean_content 
         bot_mention_pattern_nick = f'<@!{self.user.id}>'
         bot_mention_pattern_no_nick = f'<@{self.user.id}>' 
         user_message = user_message.replace(bot_mention_pattern_nick, '').replace(bot_mention_pattern_no_nick, '').strip()
 
+        if self.attachments and message.attachments:
+            excerpts = await self.attachments.read_all(message.attachments, user_message)
+            if excerpts:
+                user_message = "\n\n".join([user_message, *(excerpt.to_prompt() for excerpt in excerpts)]).strip()
+
         if not user_message:
             self.logger.info("Ignoring empty message after removing bot mention.")
 
+        try:
+            user_message, input_tokens = await self.token_budget.fit(user_message)
+        except PromptTooLarge as e:
+            self.logger.info(f"Rejected a ~{e.tokens} token prompt from {message.author} (limit {e.limit}).")
+            self.record_outcome("too_large", bucket, started)
+            try:
+                await message.reply(f"Your message is too long for me (about {e.tokens} tokens, the limit is {e.limit}). Please send only the relevant part.", mention_author=False, allowed_mentions=discord.AllowedMentions.none())
+            except discord.errors.HTTPException as reply_error:
+                self.logger.warning(f"Cannot send prompt size notice in channel {message.channel.id}: {reply_error}")
+            return
+
         self.logger.info(f"Sending to AI: '{user_message[:100]}...'")
+        conversation_key, follow_up = self.conversation_scope(message)
+        context = await self.conversations.get_context(conversation_key) if self.conversations and follow_up else None
+        instructions = await self.instructions.resolve(guild_settings)
+        request_key = make_cache_key(user_message, instructions.digest, context.digest() if context else "")
+        cache_key = request_key if self.is_cache_enabled(guild_settings, user_message) else None
+        if cache_key:
+            cached_response = await self.response_cache.get(cache_key)
+            if cached_response is None and degraded and context:
+                cached_response = await self.response_cache.get(make_cache_key(user_message, instructions.digest))
+            outcome = "cached"
+            if cached_response is None and self.similar_questions and (degraded or not context):
+                match = await self.similar_questions.lookup(user_message, instructions.digest)
+                if match is not None:
+                    self.logger.info(f"Serving the answer to a similar question ({match.similarity:.0%} similar): '{match.question[:80]}'")
+                    cached_response, outcome = match.answer, "similar"
+            if cached_response is not None:
+                self.logger.info(f"Serving cached AI response. Cache stats: {self.response_cache.stats()}")
+                await self.send_ai_reply(message, f"{cached_response}{RESPONSE_FOOTER}")
+                self.record_outcome(outcome, bucket, started)
+                await self.remember_turn(conversation_key, user_message, cached_response)
+                return
+
+        if is_guild and not await self.usage.allow(message.guild.id, guild_settings):
+            self.logger.info(f"Guild {message.guild.id} reached its daily token cap.")
+            self.record_outcome("over_budget", bucket, started)
+            if self.rate_limiter.allow_notice(message.author.id, guild_settings):
+                try:
+                    await message.reply("This server has used up today's AI budget. It resets at 00:00 UTC.", delete_after=30, mention_author=False, allowed_mentions=discord.AllowedMentions.none())
+                except discord.errors.HTTPException as e:
+                    self.logger.warning(f"Cannot send budget notice in channel {message.channel.id}: {e}")
+            return
+
+        max_output_tokens = self.token_budget.max_output_tokens(guild_settings)
+        if degraded:
+            if self.request_priority(message, guild_settings) == "low":
+                self.load_tracker.shed += 1
+                self.record_outcome("shed", bucket, started)
+                if self.rate_limiter.allow_notice(message.author.id, guild_settings):
+                    await self.send_busy_notice(message)
+                return
+            max_output_tokens = self.token_budget.max_output_tokens(guild_settings, cap=self.degraded_max_output_tokens)
+            cache_key = None
+
+        usage = TokenUsage(
+            message.guild.id if is_guild else None,
+            input_tokens + estimate_tokens(instructions.text) + (context.token_estimate() if context else 0)
+        )
+
+        schedule_key = message.guild.id if is_guild else f"dm:{message.author.id}"
+        flight_key = f"{request_key}:{max_output_tokens or 0}:{'degraded' if degraded else 'normal'}"
+        if self.stream_responses and not self.single_flight.is_in_flight(flight_key):
+            try:
+                ai_response = await self.single_flight.do(flight_key, lambda: self.scheduler.run(schedule_key, lambda: self.stream_ai_reply(message, user_message, cache_key, context, max_output_tokens, instructions, usage)))
+                self.record_outcome("ok" if ai_response is not None else "error", bucket, started)
+                if ai_response is not None:
+                    self.record_usage(usage, ai_response)
+                    await self.remember_answer(user_message, ai_response, instructions.digest, cache_key, context)
+                    await self.remember_turn(conversation_key, user_message, ai_response)
+            except SchedulerBusy:
+                self.record_outcome("busy", bucket, started)
+                await self.send_busy_notice(message)
+            except AIResponseError as e:
+                self.record_outcome(e.reason, bucket, started)
+                self.logger.debug("Streaming reply failed before the first chunk, error was sent as the reply.")
+            return
+
+        succeeded = False
+        outcome = "error"
         async with message.channel.typing():
             try:
-                ai_response = await get_ai_response(user_message)
+                ai_response = await self.single_flight.do(flight_key, lambda: self.scheduler.run(schedule_key, lambda: self.fetch_ai_response(user_message, cache_key, context, max_output_tokens, instructions, usage)))
+                if ai_response is None:
+                    ai_response = "Sorry, there was an error generating the response. Please try again."
+                else:
+                    succeeded = True
+                    outcome = "ok"
+                    self.record_usage(usage, ai_response)
+            except SchedulerBusy:
+                self.record_outcome("busy", bucket, started)
+                await self.send_busy_notice(message)
+                return
+            except AIResponseError as e:
+                ai_response = str(e)
+                outcome = e.reason
             except Exception as e:
                 self.logger.error(f"Exception during get_ai_response call: {e}")
                 ai_response = f"Sorry, there was an internal error contacting the AI service ({type(e).__name__})."
 
-        response_content = f"{ai_response}\n\n-# Scriptly can make mistakes, don't rely on it."
+        await self.send_ai_reply(message, f"{ai_response}{RESPONSE_FOOTER}")
+        self.record_outcome(outcome, bucket, started)
+        if succeeded:
+            await self.remember_answer(user_message, ai_response, instructions.digest, cache_key, context)
+            await self.remember_turn(conversation_key, user_message, ai_response)
+
+
+    async def fetch_ai_response(self, user_message: str, cache_key: Optional[str] = None, context: Optional[ConversationContext] = None, max_output_tokens: Optional[int] = None, instructions: InstructionProfile = DEFAULT_PROFILE,
+                                usage: Optional[TokenUsage] = None) -> str:
+        ai_response = await get_ai_response(user_message, context, max_output_tokens, instructions, usage)
+        self.record_usage(usage, ai_response)
+        if cache_key:
+            self.response_cache.set(cache_key, ai_response)
+        return ai_response
+
+
+    def record_usage(self, usage: Optional[TokenUsage], ai_response: str):
+        if usage is None or usage.recorded:
+            return
+        usage.recorded = True
+        usage.finish(ai_response)
+        self.usage.record(usage)
+
 
+    def record_outcome(self, outcome: str, bucket: str, started: float):
+        elapsed = time.perf_counter() - started
+        RESPONSES.inc(outcome=outcome, guild_bucket=bucket)
+        MENTION_LATENCY.observe(elapsed, outcome=outcome)
+        if outcome in ("ok", "error", "blocked"):
+            self.load_tracker.record_latency(elapsed)
+
+
+    def request_priority(self, message: discord.Message, guild_settings: Optional[dict]) -> str:
+        if guild_settings and guild_settings.get('priority') in ("low", "normal", "high"):
+            return guild_settings['priority']
+        return "low" if message.guild is None else "normal"
+
+
+    def conversation_scope(self, message: discord.Message) -> Tuple[str, bool]:
+        if isinstance(message.channel, discord.Thread):
+            return f"thread:{message.channel.id}", True
+        if message.guild is None:
+            return f"dm:{message.author.id}", True
+        reference = message.reference.resolved if message.reference else None
+        follow_up = isinstance(reference, discord.Message) and reference.author.id == self.user.id
+        return f"{message.channel.id}:{message.author.id}", follow_up
+
+
+    async def remember_answer(self, user_message: str, ai_response: str, instructions_digest: str, cache_key: Optional[str], context: Optional[ConversationContext]):
+        if self.similar_questions is None or cache_key is None or context:
+            return
+        await self.similar_questions.add(user_message, ai_response, instructions_digest)
+
+
+    async def remember_turn(self, conversation_key: str, user_message: str, ai_response: str):
+        if self.conversations is None or not user_message:
+            return
         try:
-            if len(response_content) > 2000:
-                self.logger.info("Response > 2000 chars, sending as file.")
-                response_bytes = response_content.encode('utf-8')
-                buffer = io.BytesIO(response_bytes)
-                await message.reply("My response was too long, so I've attached it as a file:", file=discord.File(fp=buffer, filename="response.txt"), mention_author=False)
-            else:
-                await message.reply(response_content, mention_author=False, allowed_mentions=discord.AllowedMentions.none())
+            await self.conversations.record(conversation_key, user_message, ai_response)
+        except Exception as e:
+            self.logger.warning(f"Failed to record conversation turn for {conversation_key}: {e}")
+
+
+    async def send_busy_notice(self, message: discord.Message):
+        self.logger.info(f"AI queue is full, sending busy notice. Scheduler stats: {self.scheduler.stats()}")
+        try:
+            await message.reply("I'm handling a lot of requests right now. Please try again in a moment.", delete_after=15, mention_author=False, allowed_mentions=discord.AllowedMentions.none())
         except discord.errors.Forbidden:
+            self.logger.warning(f"Cannot send busy notice in channel {message.channel.id} (Forbidden).")
+        except Exception as e:
+            self.logger.error(f"Error sending busy notice: {e}")
+
+
+    def is_cache_enabled(self, guild_settings: Optional[dict], user_message: str) -> bool:
+        if self.response_cache is None or not user_message:
+            return False
+        if guild_settings is not None and not guild_settings.get('cache_enabled', True):
+            return False
+        return True
+
+
+    async def send_ai_reply(self, message: discord.Message, response_content: str):
+        try:
+            await send_chunked_reply(message, response_content, file_threshold=self.reply_file_threshold)
+        except Exception as e:
+            await self.handle_reply_error(message, e)
+
+
+    async def stream_ai_reply(self, message: discord.Message, user_message: str, cache_key: Optional[str] = None, context: Optional[ConversationContext] = None, max_output_tokens: Optional[int] = None, instructions: InstructionProfile = DEFAULT_PROFILE,
+                              usage: Optional[TokenUsage] = None) -> Optional[str]:
+        chunks = stream_ai_response(user_message, context, max_output_tokens, instructions, usage).__aiter__()
+        streamer = StreamingReply(message, footer=RESPONSE_FOOTER, edit_interval=self.stream_edit_interval, file_threshold=self.reply_file_threshold)
+        try:
+            async with message.channel.typing():
+                try:
+                    first_chunk = await anext(chunks)
+                except AIResponseError as e:
+                    await self.send_ai_reply(message, f"{e}{RESPONSE_FOOTER}")
+                    raise
+
+            await streamer.start(first_chunk)
+            self.logger.debug(f"First streamed chunk delivered to channel {message.channel.id}.")
+            completed = False
+            try:
+                async for chunk in chunks:
+                    streamer.feed(chunk)
+                completed = True
+            except AIResponseError as e:
+                streamer.feed(f"\n\n*{e}*")
+            await streamer.finish()
+            self.record_usage(usage, streamer.text)
+
+            if not completed:
+                return None
+            if cache_key:
+                self.response_cache.set(cache_key, streamer.text)
+            return streamer.text
+        except AIResponseError:
+            raise
+        except Exception as e:
+            await streamer.abort()
+            await self.handle_reply_error(message, e)
+            return None
+        finally:
+            await chunks.aclose()
+
+
+    async def handle_reply_error(self, message: discord.Message, error: Exception):
+        if isinstance(error, discord.errors.Forbidden):
             self.logger.warning(f"Cannot send message/reply in channel {message.channel.id} (Forbidden).")
-        except discord.errors.HTTPException as e:
-            self.logger.exception(f"Failed to send message (HTTP {e.status}, Code {e.code}): {e.text}")
+        elif isinstance(error, discord.errors.HTTPException):
+            self.logger.error(f"Failed to send message (HTTP {error.status}, Code {error.code}): {error.text}", exc_info=error)
             try:
-                 await message.channel.send(f"{message.author.mention} Sorry, I encountered an error sending the response ({e.status}). Please try again later.", delete_after=20)
+                 await message.channel.send(f"{message.author.mention} Sorry, I encountered an error sending the response ({error.status}). Please try again later.", delete_after=20)
             except Exception:
                 self.logger.warning(f"Also failed to send error message to channel {message.channel.id}.")
-        except Exception as e:
-             self.logger.exception(f"An unexpected error occurred during message reply.")
+        else:
+             self.logger.error(f"An unexpected error occurred during message reply.", exc_info=error)
              try:
                   await message.channel.send(f"{message.author.mention} Sorry, an unexpected error occurred while replying.", delete_after=15)
              except Exception:
                   self.logger.warning(f"Also failed to send generic error message to channel {message.channel.id}.")
 
 
+    async def on_command_completion(self, ctx: commands.Context):
+        COMMANDS.inc(command=ctx.command.qualified_name)
+
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        COMMANDS.inc(command=f"/{command.qualified_name}")
+
+
     async def on_command_error(self, ctx: commands.Context, error):
         if isinstance(error, commands.CommandNotFound):
             return
@@ -245,10 +666,29 @@ class ScriptlyBot(commands.Bot):
          self.logger.info("Initiating bot shutdown sequence...")
          cancel_status_task() 
          await super().close()
+         if self._ai_startup and not self._ai_startup.done():
+             self._ai_startup.cancel()
+         if self.scheduler:
+             await self.scheduler.close()
+         if self.metrics_server:
+             await self.metrics_server.close()
+         if self.config_watcher:
+             await self.config_watcher.close()
+         if self.instructions:
+             await self.instructions.close()
+         if self.response_cache:
+             await self.response_cache.close()
+         if self.attachments:
+             await self.attachments.close()
+         if self.conversations:
+             await self.conversations.close()
+         if self.ai_client:
+             self.logger.info("Closing AI client...")
+             await close_ai_client()
          if self.db_client:
              self.logger.info("Closing MongoDB connection...")
              try:
-                self.db_client.client.close()
+                await self.db_client.close()
                 self.logger.info("MongoDB connection closed.")
              except Exception as e:
                  self.logger.error(f"Error closing MongoDB connection: {e}")
@@ -256,13 +696,15 @@ class ScriptlyBot(commands.Bot):
 
 
 if __name__ == "__main__":
+    dotenv_path = '.env'
+    dotenv_found = os.path.exists(dotenv_path)
+    loaded = load_dotenv(dotenv_path=dotenv_path, override=True) if dotenv_found else False
+
     setup_logging()
 
     print(ASCII_ART)
 
-    dotenv_path = '.env'
-    if os.path.exists(dotenv_path):
-        loaded = load_dotenv(dotenv_path=dotenv_path, override=True) 
+    if dotenv_found:
         logging.info(f".env file loaded successfully: {loaded}")
     else:
         logging.warning(".env file not found. Relying on system environment variables.")
@@ -281,7 +723,8 @@ if __name__ == "__main__":
          logging.warning("Warning: GOOGLE_GEMINI_API_KEY environment variable not set or found in .env. AI features will be disabled/fail.")
     logging.info("Essential environment variable checks passed (or warnings noted).")
 
-    bot = ScriptlyBot()
+    bot = ScriptlyBot(startup_profile="--startup-profile" in sys.argv[1:])
+    bot.login_started = time.perf_counter()
     try:
         bot.run(
             DISCORD_TOKEN,
@@ -296,4 +739,5 @@ if __name__ == "__main__":
         logging.critical("CRITICAL: An unhandled exception occurred during bot execution.", exc_info=True)
     finally:
         logging.info("Bot process attempting to finish.")
+        stop_logging()
         logging.shutdown()
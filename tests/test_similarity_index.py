@@ -0,0 +1,68 @@
+import asyncio
+import random
+import time
+
+from utils.similarity_index import SimilarityIndex
+
+WORDS = "part script tween color touched event function loop table player character humanoid gui button click remote server client module debounce".split()
+
+def run(coro):
+    return asyncio.run(coro)
+
+async def build_index(questions, **kwargs):
+    index = SimilarityIndex(**kwargs)
+    for question, answer in questions:
+        await index.add(question, answer)
+    return index
+
+
+def test_paraphrase_matches():
+    async def scenario():
+        index = await build_index([("how do i make a part change color when touched", "answer")])
+        match = await index.lookup("how do I make a part change color when it is touched?")
+        assert match is not None and match.answer == "answer"
+    run(scenario())
+
+def test_different_line_numbers_do_not_match():
+    async def scenario():
+        index = await build_index([("I get an error on line 10 of my script", "line 10")])
+        assert await index.lookup("I get an error on line 42 of my script") is None
+        assert (await index.lookup("i get an error on line 10 of my script!")).answer == "line 10"
+    run(scenario())
+
+def test_different_identifiers_do_not_match():
+    async def scenario():
+        index = await build_index([("why does workspace.part.touched fire twice", "touched")])
+        assert await index.lookup("why does workspace.part.touchended fire twice") is None
+        assert await index.lookup("why does my_value reset after respawn") is None
+    run(scenario())
+
+def test_scopes_are_separate():
+    async def scenario():
+        index = SimilarityIndex()
+        await index.add("how do i make a part change color when touched", "answer", scope="a")
+        assert await index.lookup("how do i make a part change color when touched", scope="b") is None
+    run(scenario())
+
+def test_long_prompt_does_not_block_the_loop():
+    async def scenario():
+        index = await build_index([("how do i make a part change color when touched", "answer")])
+        prompt = "local part = workspace.Part\n" * 1200
+        started = time.perf_counter()
+        assert await index.lookup(prompt) is None
+        assert not await index.add(prompt, "answer")
+        assert time.perf_counter() - started < 0.005
+        assert index.stats()['skipped'] == 2
+    run(scenario())
+
+def test_lookup_latency_at_capacity():
+    async def scenario():
+        rng = random.Random(7)
+        questions = [(" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))), str(i)) for i in range(5000)]
+        index = await build_index(questions, capacity=5000)
+        probes = [questions[rng.randrange(len(questions))][0] + " please help" for _ in range(500)]
+        started = time.perf_counter()
+        for probe in probes:
+            await index.lookup(probe)
+        assert (time.perf_counter() - started) / len(probes) < 0.001
+    run(scenario())
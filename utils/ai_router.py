@@ -0,0 +1,285 @@
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from utils.load_tracker import SlidingWindowCounter, SlidingWindowLatency
+from utils.rate_limit import CircuitBreaker, CircuitOpenError, TokenBucket, is_rate_limit_error, is_timeout_error
+
+logger = logging.getLogger(__name__)
+
+def is_server_error(error: Exception) -> bool:
+    code = getattr(error, 'code', None)
+    return isinstance(code, int) and 500 <= code < 600
+
+def is_failover_error(error: Exception) -> bool:
+    return isinstance(error, CircuitOpenError) or is_rate_limit_error(error) or is_timeout_error(error) or is_server_error(error)
+
+
+class Route:
+    def __init__(self, client, key_index: int, tier: int, rpm: float = 0.0, window: float = 300.0, quota_window: float = 60.0):
+        self.client = client
+        self.key_index = key_index
+        self.tier = tier
+        self.name = f"key{key_index + 1}/{client.model_name}"
+        self.quota = TokenBucket(rpm, int(rpm)) if rpm > 0 else None
+        self.latency = SlidingWindowLatency(window)
+        self.requests = SlidingWindowCounter(window, resolution=5.0)
+        self.errors = SlidingWindowCounter(window, resolution=5.0)
+        self.recent_requests = SlidingWindowCounter(quota_window)
+        self.rate_limited = SlidingWindowCounter(quota_window)
+        self.censored = 0
+        self.failovers = 0
+        self.hedges_won = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.client.model_name
+
+    def retry_after(self) -> float:
+        breaker = self.client.breaker
+        return breaker.retry_after() if breaker.state == CircuitBreaker.OPEN else 0.0
+
+    def remaining_quota(self) -> float:
+        requests = self.recent_requests.total()
+        observed = 1.0 - self.rate_limited.total() / requests if requests else 1.0
+        if self.quota is None:
+            return observed
+        self.quota.retry_after()
+        return min(observed, self.quota.tokens / self.quota.capacity)
+
+    def error_rate(self) -> float:
+        requests = self.requests.total()
+        return self.errors.total() / requests if requests else 0.0
+
+    def healthy(self, min_samples: int, max_error_rate: float) -> bool:
+        if self.retry_after() > 0:
+            return False
+        if self.quota is not None and self.quota.retry_after() > 0:
+            return False
+        return self.requests.total() < min_samples or self.error_rate() <= max_error_rate
+
+    def record(self, seconds: float, error: Optional[Exception] = None):
+        if isinstance(error, CircuitOpenError):
+            return
+        self.requests.add()
+        self.recent_requests.add()
+        if error is None:
+            self.latency.observe(seconds)
+        else:
+            self.errors.add()
+            if is_rate_limit_error(error):
+                self.rate_limited.add()
+
+    def record_cancelled(self, seconds: float):
+        self.requests.add()
+        self.recent_requests.add()
+        self.latency.observe(seconds)
+        self.censored += 1
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(0.95)
+        breaker = self.client.breaker.stats()
+        return {
+            'name': self.name,
+            'state': breaker['state'],
+            'retry_after': breaker['retry_after'],
+            'requests': self.requests.total(),
+            'error_rate': round(self.error_rate() * 100, 1),
+            'p95_ms': round(p95 * 1000) if p95 is not None else None,
+            'quota': round(self.remaining_quota() * 100),
+            'rate_limited': self.rate_limited.total(),
+            'censored': self.censored,
+            'in_flight': self.client.in_flight,
+            'failovers': self.failovers,
+            'hedges_won': self.hedges_won,
+        }
+
+
+class AIRouter:
+    def __init__(self, routes: Sequence[Route], max_attempts: int = 3, hedge: bool = False, hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 1.0, hedge_max_delay: float = 15.0, hedge_budget: float = 0.1, min_samples: int = 10, max_error_rate: float = 0.5):
+        if not routes:
+            raise ValueError("AIRouter needs at least one route.")
+        self.routes = list(routes)
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = hedge and len(self.routes) > 1
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedge_budget = hedge_budget
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.failovers = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._recent_hedges = SlidingWindowCounter(300.0, resolution=5.0)
+        logger.info(f"AI router created with {len(self.routes)} route(s): {', '.join(route.name for route in self.routes)}. Hedging: {'on' if self.hedge else 'off'}")
+
+    @property
+    def primary(self):
+        return self.routes[0].client
+
+    @property
+    def model_name(self) -> str:
+        return self.primary.model_name
+
+    @property
+    def system_instruction_mode(self) -> bool:
+        return self.primary.system_instruction_mode
+
+    @property
+    def in_flight(self) -> int:
+        return sum(route.client.in_flight for route in self.routes)
+
+    @property
+    def max_concurrency(self) -> int:
+        return sum(route.client.max_concurrency for route in self.routes)
+
+    def retry_after(self) -> float:
+        return max(1.0, min(route.retry_after() for route in self.routes))
+
+    def select(self, exclude: Sequence[Route] = (), model_name: Optional[str] = None) -> Optional[Route]:
+        candidates = [route for route in self.routes if route not in exclude and (model_name is None or route.model_name == model_name)]
+        if not candidates and model_name is not None:
+            candidates = [route for route in self.routes if route not in exclude]
+        pool = [route for route in candidates if route.healthy(self.min_samples, self.max_error_rate)]
+        if not pool:
+            pool = [route for route in candidates if route.retry_after() <= 0]
+        if not pool:
+            return None
+        tier = min(route.tier for route in pool)
+        return min(
+            (route for route in pool if route.tier == tier),
+            key=lambda route: (-route.remaining_quota(), route.client.in_flight, route.error_rate(), route.latency.percentile(0.5) or 0.0)
+        )
+
+    def hedge_delay(self, route: Route) -> float:
+        delay = route.latency.percentile(self.hedge_quantile) if len(route.latency) >= self.min_samples else None
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, delay if delay is not None else self.hedge_max_delay))
+
+    def _hedge_allowed(self) -> bool:
+        requests = sum(route.requests.total() for route in self.routes)
+        return self._recent_hedges.total() < max(1.0, self.hedge_budget * requests)
+
+    def _failed_over(self, route: Route, error: Exception):
+        route.failovers += 1
+        self.failovers += 1
+        logger.warning(f"Gemini route {route.name} failed ({type(error).__name__}: {error}), trying another route.")
+
+    async def _call(self, route: Route, contents, kwargs: Dict[str, Any]):
+        if route.quota is not None:
+            route.quota.consume()
+        started = time.perf_counter()
+        try:
+            response = await route.client.generate(contents, model_name=route.model_name, **kwargs)
+        except asyncio.CancelledError:
+            route.record_cancelled(time.perf_counter() - started)
+            raise
+        except Exception as e:
+            route.record(time.perf_counter() - started, e)
+            raise
+        route.record(time.perf_counter() - started)
+        return response
+
+    async def _hedged_call(self, route: Route, tried: List[Route], contents, model_name: Optional[str], kwargs: Dict[str, Any]):
+        tasks = {asyncio.create_task(self._call(route, contents, kwargs)): route}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(route))
+            backup = None if done or not self._hedge_allowed() else self.select(tried, model_name)
+            if backup is not None:
+                tried.append(backup)
+                self.hedged += 1
+                self._recent_hedges.add()
+                logger.debug(f"Gemini route {route.name} is slow, hedging on {backup.name}.")
+                tasks[asyncio.create_task(self._call(backup, contents, kwargs))] = backup
+
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] is backup:
+                            self.hedge_wins += 1
+                            backup.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+                    if not is_failover_error(error):
+                        raise error
+                    self._failed_over(tasks[task], error)
+            raise error
+        finally:
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+
+    async def generate(self, contents, model_name: Optional[str] = None, **kwargs):
+        tried: List[Route] = []
+        last_error: Optional[Exception] = None
+        while len(tried) < self.max_attempts:
+            route = self.select(tried, model_name)
+            if route is None:
+                break
+            tried.append(route)
+            try:
+                if self.hedge:
+                    return await self._hedged_call(route, tried, contents, model_name, kwargs)
+                return await self._call(route, contents, kwargs)
+            except Exception as e:
+                if not is_failover_error(e):
+                    raise
+                last_error = e
+                if not self.hedge:
+                    self._failed_over(route, e)
+        raise last_error or CircuitOpenError(self.retry_after())
+
+    async def stream(self, contents, model_name: Optional[str] = None, **kwargs) -> AsyncIterator[Any]:
+        tried: List[Route] = []
+        last_error: Optional[Exception] = None
+        while len(tried) < self.max_attempts:
+            route = self.select(tried, model_name)
+            if route is None:
+                break
+            tried.append(route)
+            if route.quota is not None:
+                route.quota.consume()
+            started = time.perf_counter()
+            produced = False
+            try:
+                async for chunk in route.client.stream(contents, model_name=route.model_name, **kwargs):
+                    produced = True
+                    yield chunk
+            except Exception as e:
+                route.record(time.perf_counter() - started, e)
+                if produced or not is_failover_error(e):
+                    raise
+                last_error = e
+                self._failed_over(route, e)
+                continue
+            route.record(time.perf_counter() - started)
+            return
+        raise last_error or CircuitOpenError(self.retry_after())
+
+    async def count_tokens(self, contents) -> int:
+        route = self.select() or self.routes[0]
+        return await route.client.count_tokens(contents, route.model_name)
+
+    def get_model(self, model_name: Optional[str] = None):
+        return self.primary.get_model(model_name)
+
+    async def warm_up(self):
+        await asyncio.gather(*(route.client.warm_up() for route in self.routes))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'routes': [route.stats() for route in self.routes],
+            'failovers': self.failovers,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+        }
+
+    async def close(self):
+        await asyncio.gather(*(route.client.close() for route in self.routes))
@@ -1,76 +1,456 @@
+from __future__ import annotations
+
 import os
+import time
 import asyncio
-import google.generativeai as genai
 import logging
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from utils.ai_router import AIRouter, Route
+from utils.conversation import ConversationContext
+from utils.instructions import DEFAULT_PROFILE, InstructionProfile
+from utils.token_budget import TokenUsage
+from utils.metrics import GEMINI_LATENCY
+from utils.response_cache import instructions_hash
+from utils.rate_limit import CircuitBreaker, CircuitOpenError, is_rate_limit_error, is_timeout_error, parse_retry_after
 
-_instructions = ""
 logger = logging.getLogger(__name__)
 
-def load_instructions():
-    global _instructions
+genai = None
+glm = None
+
+DEFAULT_MODEL_NAME = "gemini-1.5-flash-latest"
+CLIENT_OVERRIDE_VERSIONS = ((0, 5), (0, 9))
+
+class AIResponseError(Exception):
+    def __init__(self, message: str, reason: str = "error"):
+        super().__init__(message)
+        self.reason = reason
+
+def import_genai():
+    global genai, glm
+    if genai is None:
+        started = time.perf_counter()
+        import google.generativeai as generativeai
+        import google.ai.generativelanguage as generativelanguage
+        genai, glm = generativeai, generativelanguage
+        logger.info(f"Imported google.generativeai in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    return genai
+
+
+def supports_client_override() -> bool:
     try:
-        with open('instructions.txt', 'r', encoding='utf-8') as f:
-            _instructions = f.read().strip()
-        if not _instructions:
-            logger.warning("instructions.txt is empty or contains only whitespace.")
+        version = tuple(int(part) for part in genai.__version__.split(".")[:2])
+    except (AttributeError, ValueError):
+        return False
+    low, high = CLIENT_OVERRIDE_VERSIONS
+    return low <= version < high
+
+
+def _log_task_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Background AI task failed: {task.exception()}")
+
+
+class _SystemModel:
+    __slots__ = ('model', 'cached_content', 'expires_at')
+
+    def __init__(self, model: genai.GenerativeModel, cached_content=None, expires_at: Optional[float] = None):
+        self.model = model
+        self.cached_content = cached_content
+        self.expires_at = expires_at
+
+
+class AIClient:
+    def __init__(self, api_key: str, model_name: str = DEFAULT_MODEL_NAME, max_concurrency: int = 16, request_timeout: float = 60.0, breaker: Optional[CircuitBreaker] = None,
+                 system_instruction_mode: bool = True, context_cache: bool = False, context_cache_ttl: int = 3600, max_system_models: int = 8, configure_default: bool = True):
+        if not api_key:
+            raise ValueError("GOOGLE_GEMINI_API_KEY was not provided to AIClient constructor.")
+
+        import_genai()
+        if configure_default:
+            genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.in_flight = 0
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._async_client = None
+        if supports_client_override():
+            self._async_client = glm.GenerativeServiceAsyncClient(client_options={'api_key': api_key})
+        elif not configure_default:
+            logger.warning(f"google-generativeai {getattr(genai, '__version__', '?')} is not known to support per-key clients; this route will use the default API key.")
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self.system_instruction_mode = system_instruction_mode
+        self.context_cache = context_cache
+        self.context_cache_ttl = context_cache_ttl
+        self.max_system_models = max_system_models
+        self._system_models: "OrderedDict[Tuple[str, str], _SystemModel]" = OrderedDict()
+        self._context_cache_retry_at: Dict[Tuple[str, str], float] = {}
+        self._system_model_builds: Dict[Tuple[str, str], asyncio.Future] = {}
+        logger.info(f"AIClient created. Model: {model_name}, max concurrency: {max_concurrency}, timeout: {request_timeout}s")
+
+    def get_model(self, model_name: Optional[str] = None) -> genai.GenerativeModel:
+        name = model_name or self.model_name
+        model = self._models.get(name)
+        if model is None:
+            model = self._bind_client(genai.GenerativeModel(name))
+            self._models[name] = model
+            logger.debug(f"Created model handle for {name}.")
+        return model
+
+    def _bind_client(self, model: genai.GenerativeModel) -> genai.GenerativeModel:
+        if self._async_client is not None:
+            model._async_client = self._async_client
+        return model
+
+    async def get_system_model(self, instructions: str, model_name: Optional[str] = None, digest: Optional[str] = None) -> genai.GenerativeModel:
+        name = model_name or self.model_name
+        key = (name, digest or instructions_hash(instructions))
+        entry = self._system_models.get(key)
+        if entry is not None and (entry.expires_at is None or entry.expires_at > time.monotonic()):
+            self._system_models.move_to_end(key)
+            return entry.model
+
+        building = self._system_model_builds.get(key)
+        if building is not None:
+            return await asyncio.shield(building)
+
+        future = asyncio.get_running_loop().create_future()
+        self._system_model_builds[key] = future
+        try:
+            if entry is not None:
+                self._discard_system_model(self._system_models.pop(key))
+
+            entry = None
+            if self.context_cache and self._context_cache_retry_at.get(key, 0.0) <= time.monotonic():
+                entry = await self._create_cached_model(name, instructions, key)
+            if entry is None:
+                entry = _SystemModel(genai.GenerativeModel(name, system_instruction=instructions))
+            self._bind_client(entry.model)
+
+            self._system_models[key] = entry
+            while len(self._system_models) > self.max_system_models:
+                _, evicted = self._system_models.popitem(last=False)
+                self._discard_system_model(evicted)
+            logger.info(f"Built system-instruction model for {name} (instructions {key[1]}, context cache: {'yes' if entry.cached_content else 'no'}).")
+            future.set_result(entry.model)
+            return entry.model
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            del self._system_model_builds[key]
+
+    async def _create_cached_model(self, name: str, instructions: str, key: Tuple[str, str]) -> Optional[_SystemModel]:
+        creating = asyncio.ensure_future(asyncio.to_thread(
+            genai.caching.CachedContent.create,
+            model=name,
+            display_name=f"scriptly-{key[1]}",
+            system_instruction=instructions,
+            ttl=timedelta(seconds=self.context_cache_ttl)
+        ))
+        try:
+            cached_content = await asyncio.wait_for(asyncio.shield(creating), timeout=self.request_timeout)
+        except asyncio.CancelledError:
+            creating.add_done_callback(self._delete_late_cache)
+            raise
+        except Exception as e:
+            if not creating.done():
+                creating.add_done_callback(self._delete_late_cache)
+            self._context_cache_retry_at[key] = time.monotonic() + 600
+            logger.warning(f"Context caching unavailable for {name} ({type(e).__name__}: {e}). Falling back to a plain system instruction.")
+            return None
+        model = genai.GenerativeModel.from_cached_content(cached_content)
+        return _SystemModel(model, cached_content, time.monotonic() + self.context_cache_ttl * 0.9)
+
+    def _discard_system_model(self, entry: _SystemModel):
+        if entry.cached_content is None:
+            return
+        task = asyncio.create_task(asyncio.to_thread(entry.cached_content.delete))
+        task.add_done_callback(_log_task_failure)
+
+    def _delete_late_cache(self, creating: asyncio.Future):
+        if creating.cancelled() or creating.exception() is not None:
+            return
+        logger.info("Deleting a context cache that was created after its request timed out.")
+        self._discard_system_model(_SystemModel(None, creating.result()))
+
+    async def _resolve_model(self, model_name: Optional[str], instructions: Optional[str], digest: Optional[str] = None) -> genai.GenerativeModel:
+        if instructions and self.system_instruction_mode:
+            return await self.get_system_model(instructions, model_name, digest)
+        return self.get_model(model_name)
+
+    async def warm_up(self):
+        try:
+            await asyncio.wait_for(self.get_model().count_tokens_async("ping"), timeout=self.request_timeout)
+            logger.info("Gemini connection warmed up.")
+        except Exception as e:
+            logger.warning(f"Gemini warm-up request failed ({type(e).__name__}): {e}")
+
+    async def count_tokens(self, contents, model_name: Optional[str] = None) -> int:
+        response = await asyncio.wait_for(self.get_model(model_name).count_tokens_async(contents), timeout=self.request_timeout)
+        return response.total_tokens
+
+    def _check_breaker(self):
+        if self.breaker.state == CircuitBreaker.OPEN and self.breaker.retry_after() > 0:
+            self.breaker.rejected += 1
+            raise CircuitOpenError(self.breaker.retry_after())
+
+    def _record_failure(self, error: Exception):
+        if is_rate_limit_error(error) or is_timeout_error(error):
+            self.breaker.record_failure(parse_retry_after(error))
         else:
-            logger.info("Instructions loaded from instructions.txt")
-    except FileNotFoundError:
-        logger.error("instructions.txt not found. Using basic AI fallback prompt.")
-        _instructions = "You are a helpful AI assistant."
-    except Exception as e:
-        logger.exception(f"Error loading instructions.txt: {e}")
-        _instructions = "You are a helpful AI assistant."
+            self.breaker.record_neutral()
 
-async def get_ai_response(user_message: str) -> str:
-    google_api_key_value = os.getenv("GOOGLE_GEMINI_API_KEY")
-    logger.debug(f"Inside get_ai_response: Value of os.getenv('GOOGLE_GEMINI_API_KEY') = '{google_api_key_value}'")
+    async def generate(self, contents, model_name: Optional[str] = None, instructions: Optional[str] = None, instructions_digest: Optional[str] = None, **kwargs):
+        model = await self._resolve_model(model_name, instructions, instructions_digest)
+        self._check_breaker()
+        async with self._semaphore:
+            self.breaker.before_call()
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(contents, **kwargs),
+                    timeout=self.request_timeout
+                )
+            except Exception as e:
+                self._record_failure(e)
+                GEMINI_LATENCY.observe(time.perf_counter() - started, mode="generate", outcome="error")
+                raise
+            except BaseException:
+                self.breaker.record_neutral()
+                raise
+            finally:
+                self.in_flight -= 1
+            self.breaker.record_success()
+            GEMINI_LATENCY.observe(time.perf_counter() - started, mode="generate", outcome="ok")
+            return response
+
+    async def stream(self, contents, model_name: Optional[str] = None, instructions: Optional[str] = None, instructions_digest: Optional[str] = None, **kwargs):
+        model = await self._resolve_model(model_name, instructions, instructions_digest)
+        self._check_breaker()
+        async with self._semaphore:
+            self.breaker.before_call()
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(contents, stream=True, **kwargs),
+                    timeout=self.request_timeout
+                )
+                iterator = response.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), timeout=self.request_timeout)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+            except Exception as e:
+                self._record_failure(e)
+                GEMINI_LATENCY.observe(time.perf_counter() - started, mode="stream", outcome="error")
+                raise
+            except BaseException:
+                self.breaker.record_neutral()
+                raise
+            finally:
+                self.in_flight -= 1
+            self.breaker.record_success()
+            GEMINI_LATENCY.observe(time.perf_counter() - started, mode="stream", outcome="ok")
 
+    async def close(self):
+        for entry in self._system_models.values():
+            if entry.cached_content is not None:
+                try:
+                    await asyncio.to_thread(entry.cached_content.delete)
+                except Exception as e:
+                    logger.debug(f"Failed to delete cached content on close: {e}")
+        self._system_models.clear()
+        if self._async_client is None:
+            return
+        try:
+            await self._async_client.transport.close()
+            logger.info("AIClient transport closed.")
+        except Exception as e:
+            logger.error(f"Error closing AIClient transport: {e}")
+
+
+_ai_client_instance: Optional[AIRouter] = None
+
+def _env_list(name: str) -> List[str]:
+    return [item.strip() for item in os.getenv(name, "").split(",") if item.strip()]
+
+def build_ai_router() -> AIRouter:
+    google_api_key_value = os.getenv("GOOGLE_GEMINI_API_KEY")
     if not google_api_key_value:
-        logger.error("GOOGLE_GEMINI_API_KEY is not configured or found in environment.")
-        return "Error: GOOGLE_GEMINI_API_KEY is not configured."
+        raise ValueError("GOOGLE_GEMINI_API_KEY environment variable is required but was not found.")
+
+    api_keys = list(dict.fromkeys([google_api_key_value, *_env_list("GOOGLE_GEMINI_API_KEYS")]))
+    model_names = _env_list("GEMINI_MODELS") or [os.getenv("GEMINI_MODEL", DEFAULT_MODEL_NAME)]
+    context_cache = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() in ("1", "true", "yes")
+    route_rpm = float(os.getenv("GEMINI_ROUTE_RPM", "0"))
+    routes = []
+    for tier, model_name in enumerate(model_names):
+        for key_index, api_key in enumerate(api_keys):
+            client = AIClient(
+                api_key=api_key,
+                model_name=model_name,
+                max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")),
+                request_timeout=float(os.getenv("GEMINI_REQUEST_TIMEOUT", "60")),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("GEMINI_BREAKER_THRESHOLD", "3")),
+                    base_backoff=float(os.getenv("GEMINI_BREAKER_BACKOFF", "5")),
+                    max_backoff=float(os.getenv("GEMINI_BREAKER_MAX_BACKOFF", "300"))
+                ),
+                system_instruction_mode=os.getenv("GEMINI_SYSTEM_INSTRUCTION", "true").lower() in ("1", "true", "yes"),
+                context_cache=context_cache and key_index == 0,
+                context_cache_ttl=int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600")),
+                max_system_models=int(os.getenv("GEMINI_MAX_SYSTEM_MODELS", "8")),
+                configure_default=key_index == 0
+            )
+            routes.append(Route(client, key_index, tier, rpm=route_rpm))
+
+    return AIRouter(
+        routes,
+        max_attempts=int(os.getenv("GEMINI_MAX_ATTEMPTS", "3")),
+        hedge=os.getenv("GEMINI_HEDGE", "false").lower() in ("1", "true", "yes"),
+        hedge_quantile=float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.95")),
+        hedge_min_delay=float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "1")),
+        hedge_max_delay=float(os.getenv("GEMINI_HEDGE_MAX_DELAY", "15")),
+        hedge_budget=float(os.getenv("GEMINI_HEDGE_BUDGET", "0.1"))
+    )
 
-    if not _instructions:
-        load_instructions()
+async def get_ai_client() -> AIRouter:
+    global _ai_client_instance
+    if _ai_client_instance is None:
+        _ai_client_instance = build_ai_router()
+        await _ai_client_instance.warm_up()
+    return _ai_client_instance
 
-    current_instructions = _instructions if _instructions else "You are a helpful AI assistant."
+async def close_ai_client():
+    global _ai_client_instance
+    if _ai_client_instance is not None:
+        await _ai_client_instance.close()
+        _ai_client_instance = None
 
-    combined_prompt = f"{current_instructions}\n\nUser Query: {user_message}"
+
+def _build_prompt(user_message: str, context: Optional[ConversationContext] = None, instructions: Optional[str] = None):
+    current_instructions = f"{instructions}\n\n" if instructions else ""
+
+    summary = f"Conversation so far (summary): {context.summary}\n\n" if context and context.summary else ""
+    combined_prompt = f"{current_instructions}{summary}User Query: {user_message}"
     logger.debug(f"Combined prompt starts with: '{combined_prompt[:100]}...'")
+    if not context or not context.turns:
+        return combined_prompt
+
+    contents = [{'role': role, 'parts': [text]} for role, text in context.turns]
+    contents.append({'role': 'user', 'parts': [combined_prompt]})
+    return contents
+
+def _generation_kwargs(max_output_tokens: Optional[int]) -> Dict[str, Any]:
+    return {'generation_config': {'max_output_tokens': max_output_tokens}} if max_output_tokens else {}
+
+def _blocked_message(prompt_feedback) -> Optional[str]:
+    if prompt_feedback and prompt_feedback.block_reason:
+        block_reason = prompt_feedback.block_reason
+        block_details = prompt_feedback.block_reason_message or "No details provided."
+        logger.warning(f"AI content blocked. Reason: {block_reason}. Details: {block_details}")
+        return f"My response was blocked due to safety settings ({block_reason}). Please rephrase your request or contact support if this seems incorrect."
+    return None
+
+def _describe_ai_error(e: Exception) -> str:
+    error_type = type(e).__name__
+    error_str = str(e)
+
+    if isinstance(e, CircuitOpenError):
+        logger.info(f"Gemini circuit breaker is open, failing fast (retry after {e.retry_after:.1f}s).")
+        return f"AI Rate Limit Reached. Please try again in {max(1, round(e.retry_after))} seconds."
+
+    logger.exception(f"Gemini API Error ({error_type}) during generation: {error_str}")
+
+    if is_rate_limit_error(e):
+        return "AI Rate Limit Reached. Please try again later."
+    elif 'api key not valid' in error_str.lower():
+         return "Error: The provided GOOGLE_GEMINI_API_KEY is invalid. Please check your .env file."
+    else:
+        return f"An error occurred while contacting the AI ({error_type}). Please try again later."
+
+
+async def get_ai_response(user_message: str, context: Optional[ConversationContext] = None, max_output_tokens: Optional[int] = None, instructions: InstructionProfile = DEFAULT_PROFILE,
+                          usage: Optional[TokenUsage] = None) -> str:
+    if not os.getenv("GOOGLE_GEMINI_API_KEY"):
+        logger.error("GOOGLE_GEMINI_API_KEY is not configured or found in environment.")
+        raise AIResponseError("Error: GOOGLE_GEMINI_API_KEY is not configured.")
 
     try:
-        genai.configure(api_key=google_api_key_value)
-        model = genai.GenerativeModel("gemini-1.5-flash-latest")
-
-        response = await asyncio.to_thread(
-            model.generate_content,
-            contents=combined_prompt
-        )
-        logger.debug("Received response from Gemini API.")
-
-        if response.parts:
-            ai_text = "".join(part.text for part in response.parts)
-            logger.debug(f"AI Response Text (first 100 chars): '{ai_text[:100]}...'")
-            return ai_text
-        elif response.prompt_feedback and response.prompt_feedback.block_reason:
-            block_reason = response.prompt_feedback.block_reason
-            block_details = response.prompt_feedback.block_reason_message or "No details provided."
-            logger.warning(f"AI content blocked. Reason: {block_reason}. Details: {block_details}")
-            return f"My response was blocked due to safety settings ({block_reason}). Please rephrase your request or contact support if this seems incorrect."
-        else:
-            logger.warning(f"Received an empty or unexpected response structure from AI: {response}")
-            return "Error: Received an empty or unexpected response from the AI."
+        ai_client = await get_ai_client()
+        combined_prompt = _build_prompt(user_message, context, None if ai_client.system_instruction_mode else instructions.text)
+        response = await ai_client.generate(combined_prompt, instructions=instructions.text, instructions_digest=instructions.digest, **_generation_kwargs(max_output_tokens))
+    except Exception as e:
+        raise AIResponseError(_describe_ai_error(e)) from e
+    logger.debug("Received response from Gemini API.")
+    if usage is not None:
+        usage.update_from(getattr(response, 'usage_metadata', None))
+
+    if response.parts:
+        ai_text = "".join(part.text for part in response.parts)
+        logger.debug(f"AI Response Text (first 100 chars): '{ai_text[:100]}...'")
+        return ai_text
+
+    blocked = _blocked_message(response.prompt_feedback)
+    if blocked:
+        raise AIResponseError(blocked, reason="blocked")
 
+    logger.warning(f"Received an empty or unexpected response structure from AI: {response}")
+    raise AIResponseError("Error: Received an empty or unexpected response from the AI.")
+
+
+async def stream_ai_response(user_message: str, context: Optional[ConversationContext] = None, max_output_tokens: Optional[int] = None, instructions: InstructionProfile = DEFAULT_PROFILE,
+                             usage: Optional[TokenUsage] = None) -> AsyncIterator[str]:
+    if not os.getenv("GOOGLE_GEMINI_API_KEY"):
+        logger.error("GOOGLE_GEMINI_API_KEY is not configured or found in environment.")
+        raise AIResponseError("Error: GOOGLE_GEMINI_API_KEY is not configured.")
+
+    produced = False
+
+    try:
+        ai_client = await get_ai_client()
+        combined_prompt = _build_prompt(user_message, context, None if ai_client.system_instruction_mode else instructions.text)
+        async for chunk in ai_client.stream(combined_prompt, instructions=instructions.text, instructions_digest=instructions.digest, **_generation_kwargs(max_output_tokens)):
+            if usage is not None:
+                usage.update_from(getattr(chunk, 'usage_metadata', None))
+            if chunk.parts:
+                text = "".join(part.text for part in chunk.parts)
+                if text:
+                    produced = True
+                    yield text
+            elif not produced:
+                blocked = _blocked_message(chunk.prompt_feedback)
+                if blocked:
+                    raise AIResponseError(blocked, reason="blocked")
+    except AIResponseError:
+        raise
     except Exception as e:
-        error_type = type(e).__name__
-        error_str = str(e)
-        logger.exception(f"Gemini API Error ({error_type}) during generation: {error_str}")
-
-        if '429' in error_str or 'rate limit' in error_str.lower():
-            return "AI Rate Limit Reached. Please try again later."
-        elif 'api key not valid' in error_str.lower():
-             return "Error: The provided GOOGLE_GEMINI_API_KEY is invalid. Please check your .env file."
-        else:
-            return f"An error occurred while contacting the AI ({error_type}). Please try again later."
+        raise AIResponseError(_describe_ai_error(e)) from e
+
+    if not produced:
+        logger.warning("Gemini stream finished without producing any text.")
+        raise AIResponseError("Error: Received an empty or unexpected response from the AI.")
 
-load_instructions()
\ No newline at end of file
+async def summarize_conversation(previous_summary: str, turns: List[Tuple[str, str]]) -> str:
+    transcript = "\n".join(f"{'User' if role == 'user' else 'Assistant'}: {text}" for role, text in turns)
+    prompt = (
+        "Summarize the following Roblox Luau help conversation in under 120 words. "
+        "Keep the user's goals, relevant code identifiers, error messages and decisions made. "
+        "Write plain prose without preamble.\n\n"
+        f"Existing summary: {previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+    )
+    ai_client = await get_ai_client()
+    response = await ai_client.generate(prompt, generation_config={'max_output_tokens': 256, 'temperature': 0.2})
+    return "".join(part.text for part in response.parts) if response.parts else ""
@@ -0,0 +1,233 @@
+import re
+import codecs
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+MAX_LINE_CHARS = 500
+MAX_LINE_RANGE = 200
+LINE_PATTERNS = (
+    re.compile(r"\blines?\s*#?(\d{1,6})(?:\s*(?:-|to)\s*(\d{1,6}))?", re.IGNORECASE),
+    re.compile(r":(\d{1,6}):"),
+    re.compile(r"\bL(\d{1,6})\b"),
+)
+QUOTED_TEXT = re.compile(r"[`'\"]([^`'\"\n]{3,80})[`'\"]")
+CODE_LANGUAGES = {'.lua': 'lua', '.luau': 'lua'}
+
+def find_references(text: str) -> Tuple[Set[int], List[str]]:
+    line_numbers: Set[int] = set()
+    for pattern in LINE_PATTERNS:
+        for match in pattern.finditer(text):
+            start = int(match.group(1))
+            end = int(match.group(2)) if pattern.groups > 1 and match.group(2) else start
+            if start <= end <= start + MAX_LINE_RANGE:
+                line_numbers.update(range(start, end + 1))
+            else:
+                line_numbers.add(start)
+    needles = list(dict.fromkeys(match.group(1).strip() for match in QUOTED_TEXT.finditer(text) if match.group(1).strip()))
+    return line_numbers, needles
+
+
+class ExcerptBuilder:
+    def __init__(self, line_numbers: Iterable[int] = (), needles: Sequence[str] = (), max_chars: int = 12000, context_lines: int = 15):
+        self.line_numbers = set(line_numbers)
+        self.needles = [needle.lower() for needle in needles if needle]
+        self.max_chars = max_chars
+        self.context_lines = context_lines
+        self.line_count = 0
+        self.matches = 0
+        self._full: Optional[List[str]] = []
+        self._full_chars = 0
+        self._head: List[Tuple[int, str]] = []
+        self._head_chars = 0
+        self._head_open = True
+        self._tail: Deque[Tuple[int, str]] = deque()
+        self._tail_chars = 0
+        self._before: Deque[Tuple[int, str]] = deque(maxlen=context_lines)
+        self._kept: List[Tuple[int, str]] = []
+        self._kept_chars = 0
+        self._after = 0
+
+    def _is_match(self, number: int, line: str) -> bool:
+        if number in self.line_numbers:
+            return True
+        if self.needles:
+            lowered = line.lower()
+            return any(needle in lowered for needle in self.needles)
+        return False
+
+    def _keep(self, number: int, line: str):
+        self._kept.append((number, line))
+        self._kept_chars += len(line) + 8
+
+    def feed(self, line: str):
+        self.line_count += 1
+        number = self.line_count
+        line = line[:MAX_LINE_CHARS]
+        size = len(line) + 1
+
+        if self._full is not None:
+            if self._full_chars + size <= self.max_chars:
+                self._full.append(line)
+                self._full_chars += size
+            else:
+                self._full = None
+
+        if self._head_open and self._head_chars + size <= self.max_chars * 2 // 3:
+            self._head.append((number, line))
+            self._head_chars += size
+        else:
+            self._head_open = False
+            self._tail.append((number, line))
+            self._tail_chars += size
+            while self._tail_chars > self.max_chars // 3:
+                self._tail_chars -= len(self._tail.popleft()[1]) + 1
+
+        if self._kept_chars < self.max_chars:
+            if self._is_match(number, line):
+                self.matches += 1
+                while self._before:
+                    self._keep(*self._before.popleft())
+                self._keep(number, line)
+                self._after = self.context_lines
+                return
+            if self._after:
+                self._after -= 1
+                self._keep(number, line)
+                return
+        self._before.append((number, line))
+
+    @staticmethod
+    def _numbered(lines: Iterable[Tuple[int, str]]) -> List[str]:
+        rendered = []
+        previous = 0
+        for number, line in lines:
+            if previous and number != previous + 1:
+                rendered.append("...")
+            rendered.append(f"{number}| {line}")
+            previous = number
+        return rendered
+
+    @property
+    def complete(self) -> bool:
+        return self._full is not None
+
+    def result(self) -> str:
+        if self._full is not None:
+            return "\n".join(self._full)
+        if self._kept:
+            return "\n".join(self._numbered(self._kept))
+        return "\n".join(self._numbered([*self._head, *self._tail]))
+
+
+class AttachmentExcerpt:
+    __slots__ = ('filename', 'text', 'line_count', 'complete', 'truncated')
+
+    def __init__(self, filename: str, text: str, line_count: int, complete: bool, truncated: bool):
+        self.filename = filename
+        self.text = text
+        self.line_count = line_count
+        self.complete = complete
+        self.truncated = truncated
+
+    def to_prompt(self) -> str:
+        language = next((lang for ext, lang in CODE_LANGUAGES.items() if self.filename.lower().endswith(ext)), "")
+        if self.truncated:
+            note = " (only the beginning of the file was read)"
+        elif not self.complete:
+            note = f" (excerpt of {self.line_count} lines, lines are numbered)"
+        else:
+            note = ""
+        return f"Attached file `{self.filename}`{note}:\n```{language}\n{self.text}\n```"
+
+
+class AttachmentReader:
+    def __init__(self, extensions: Sequence[str] = (".lua", ".luau", ".txt"), max_files: int = 3, max_bytes: int = 4194304,
+                 max_chars: int = 12000, context_lines: int = 15, max_concurrency: int = 4, timeout: float = 20.0, chunk_size: int = 65536):
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_chars = max_chars
+        self.context_lines = context_lines
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.files_read = 0
+        self.bytes_read = 0
+        self.truncated = 0
+        self.skipped = 0
+        self.failed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def wants(self, attachment) -> bool:
+        return bool(attachment.size) and attachment.filename.lower().endswith(self.extensions)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def read(self, attachment, line_numbers: Set[int], needles: Sequence[str], max_chars: int) -> Optional[AttachmentExcerpt]:
+        async with self._semaphore:
+            builder = ExcerptBuilder(line_numbers, needles, max_chars, self.context_lines)
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            pending = ""
+            received = 0
+            truncated = False
+            async with self._get_session().get(attachment.url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    if received + len(chunk) > self.max_bytes:
+                        chunk = chunk[:self.max_bytes - received]
+                        truncated = True
+                    if not received and b'\x00' in chunk[:1024]:
+                        self.skipped += 1
+                        logger.info(f"Skipping attachment {attachment.filename}: looks like a binary file.")
+                        return None
+                    received += len(chunk)
+                    lines = (pending + decoder.decode(chunk)).split('\n')
+                    pending = lines.pop()[:MAX_LINE_CHARS]
+                    for line in lines:
+                        builder.feed(line.rstrip('\r'))
+                    if truncated:
+                        break
+            pending += decoder.decode(b'', final=True)
+            if pending:
+                builder.feed(pending.rstrip('\r'))
+
+        self.files_read += 1
+        self.bytes_read += received
+        if truncated:
+            self.truncated += 1
+        logger.info(f"Read attachment {attachment.filename}: {received} bytes, {builder.line_count} lines, {builder.matches} matching line(s){', truncated' if truncated else ''}.")
+        return AttachmentExcerpt(attachment.filename, builder.result(), builder.line_count, builder.complete and not truncated, truncated)
+
+    async def read_all(self, attachments: Sequence[Any], user_message: str) -> List[AttachmentExcerpt]:
+        wanted = [attachment for attachment in attachments if self.wants(attachment)]
+        self.skipped += len(attachments) - len(wanted[:self.max_files])
+        wanted = wanted[:self.max_files]
+        if not wanted:
+            return []
+        line_numbers, needles = find_references(user_message)
+        per_file_chars = max(1000, self.max_chars // len(wanted))
+        results = await asyncio.gather(*(self.read(attachment, line_numbers, needles, per_file_chars) for attachment in wanted), return_exceptions=True)
+        excerpts = []
+        for attachment, result in zip(wanted, results):
+            if isinstance(result, BaseException):
+                self.failed += 1
+                logger.warning(f"Could not read attachment {attachment.filename} ({type(result).__name__}): {result}")
+            elif result is not None:
+                excerpts.append(result)
+        return excerpts
+
+    def stats(self) -> Dict[str, int]:
+        return {'files_read': self.files_read, 'bytes_read': self.bytes_read, 'truncated': self.truncated, 'skipped': self.skipped, 'failed': self.failed}
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
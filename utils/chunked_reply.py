@@ -0,0 +1,102 @@
+import io
+import discord
+import logging
+from typing import Iterator, List, Optional, Tuple
+
+from utils.metrics import DISCORD_SEND_LATENCY
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 2000
+FENCE = "```"
+
+def _fence_states(lines: List[str]) -> List[Optional[str]]:
+    states: List[Optional[str]] = []
+    fence = None
+    for line in lines:
+        states.append(fence)
+        stripped = line.strip()
+        if stripped.startswith(FENCE):
+            if fence is not None:
+                fence = None
+            elif not (len(stripped) > len(FENCE) and stripped.endswith(FENCE)):
+                fence = stripped
+    states.append(fence)
+    return states
+
+def _hard_cut(line: str, budget: int) -> int:
+    cut = line.rfind(" ", 0, budget)
+    return cut if cut >= budget // 2 else budget
+
+def take_chunk(text: str, limit: int = MAX_MESSAGE_LENGTH) -> Tuple[str, int, Optional[str]]:
+    if len(text) <= limit:
+        return text, len(text), None
+
+    lines = text.split("\n")
+    states = _fence_states(lines)
+    closing = len(FENCE) + 1
+    size = 0
+    end = 0
+    paragraph_break = 0
+    outside_break = 0
+    while end < len(lines):
+        added = len(lines[end]) + (1 if end else 0)
+        if size + added + (closing if states[end + 1] else 0) > limit:
+            break
+        size += added
+        end += 1
+        if states[end] is None and size >= limit // 2:
+            outside_break = end
+            if end < len(lines) and not lines[end].strip():
+                paragraph_break = end
+
+    if size < limit // 4:
+        separator = 1 if end else 0
+        budget = limit - size - separator - (closing if states[end] else 0)
+        cut = _hard_cut(lines[end], budget)
+        chunk = "\n".join(lines[:end] + [lines[end][:cut]])
+        consumed = size + separator + cut + (1 if lines[end][cut:cut + 1] == " " else 0)
+        open_fence = states[end]
+    else:
+        split = paragraph_break or outside_break or end
+        chunk = "\n".join(lines[:split])
+        consumed = len(chunk) + 1
+        open_fence = states[split]
+
+    chunk = chunk.rstrip()
+    if open_fence:
+        chunk += "\n" + FENCE
+    return chunk, consumed, open_fence
+
+def iter_chunks(text: str, limit: int = MAX_MESSAGE_LENGTH) -> Iterator[str]:
+    while text:
+        chunk, consumed, open_fence = take_chunk(text, limit)
+        if chunk.strip():
+            yield chunk
+        text = text[consumed:].lstrip("\n")
+        if open_fence and text:
+            text = f"{open_fence}\n{text}"
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    return list(iter_chunks(text, limit))
+
+def build_attachment(content: str, filename: str = "response.txt") -> discord.File:
+    return discord.File(fp=io.BytesIO(content.encode('utf-8')), filename=filename)
+
+
+async def send_chunked_reply(message: discord.Message, content: str, file_threshold: int = 10000, limit: int = MAX_MESSAGE_LENGTH) -> List[discord.Message]:
+    if len(content) > file_threshold:
+        logger.info(f"Response is {len(content)} chars (> {file_threshold}), sending as file.")
+        with DISCORD_SEND_LATENCY.time(kind="file"):
+            return [await message.reply("My response was too long, so I've attached it as a file:", file=build_attachment(content), mention_author=False)]
+
+    sent = []
+    for index, chunk in enumerate(iter_chunks(content, limit)):
+        with DISCORD_SEND_LATENCY.time(kind="reply" if index == 0 else "chunk"):
+            if index == 0:
+                sent.append(await message.reply(chunk, mention_author=False, allowed_mentions=discord.AllowedMentions.none()))
+            else:
+                sent.append(await message.channel.send(chunk, allowed_mentions=discord.AllowedMentions.none()))
+    if len(sent) > 1:
+        logger.debug(f"Delivered {len(content)} chars in {len(sent)} message(s).")
+    return sent
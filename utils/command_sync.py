@@ -0,0 +1,61 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+def command_tree_signature(tree: app_commands.CommandTree, guild: Optional[discord.abc.Snowflake] = None) -> str:
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)), key=lambda data: (data.get('type', 1), data['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')).hexdigest()
+
+
+class CommandSyncState:
+    def __init__(self, path: str = ".command_sync.json"):
+        self.path = path
+
+    def load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read command sync state from {self.path}, will resync: {e}")
+            return {}
+
+    def save(self, data: Dict[str, Any]):
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write command sync state to {self.path}: {e}")
+
+
+async def sync_commands_if_changed(tree: app_commands.CommandTree, application_id: Optional[int], state: CommandSyncState,
+                                   guild_id: Optional[int] = None, force: bool = False) -> bool:
+    guild = discord.Object(id=guild_id) if guild_id else None
+    if guild is not None:
+        tree.copy_global_to(guild=guild)
+
+    scope = f"{application_id}:{guild_id or 'global'}"
+    signature = command_tree_signature(tree, guild=guild)
+    data = state.load()
+    if not force and data.get(scope, {}).get('signature') == signature:
+        logger.info(f"Application commands unchanged for {scope} (signature {signature[:12]}), skipping sync.")
+        return False
+
+    started = time.perf_counter()
+    synced = await tree.sync(guild=guild)
+    logger.info(f"Synced {len(synced)} application command(s) to {'guild ' + str(guild_id) if guild_id else 'global scope'} in {time.perf_counter() - started:.2f}s.")
+    data[scope] = {'signature': signature, 'synced_at': int(time.time()), 'commands': len(synced)}
+    state.save(data)
+    return True
@@ -0,0 +1,193 @@
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_TURN_CHARS = 4000
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class ConversationContext:
+    __slots__ = ('summary', 'turns')
+
+    def __init__(self, summary: str = "", turns: Optional[List[Tuple[str, str]]] = None):
+        self.summary = summary
+        self.turns = turns or []
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.turns)
+
+    def token_estimate(self) -> int:
+        if not self:
+            return 0
+        return (estimate_tokens(self.summary) if self.summary else 0) + sum(estimate_tokens(text) for _, text in self.turns)
+
+    def digest(self) -> str:
+        if not self:
+            return ""
+        material = self.summary + "".join(f"\x1e{role}\x1f{text}" for role, text in self.turns)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+
+
+class Conversation:
+    __slots__ = ('turns', 'summary', 'summary_tokens', 'compacting')
+
+    def __init__(self, max_turns: int):
+        self.turns: Deque[Tuple[str, str, int]] = deque(maxlen=max_turns)
+        self.summary = ""
+        self.summary_tokens = 0
+        self.compacting = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.summary_tokens + sum(tokens for _, _, tokens in self.turns)
+
+    def append(self, role: str, text: str):
+        text = text[:MAX_TURN_CHARS]
+        self.turns.append((role, text, estimate_tokens(text)))
+
+    def to_document(self, key: str) -> Dict[str, Any]:
+        return {
+            'key': key,
+            'summary': self.summary,
+            'turns': [{'role': role, 'text': text} for role, text, _ in self.turns],
+            'updated_at': datetime.now(timezone.utc),
+        }
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any], max_turns: int) -> "Conversation":
+        conversation = cls(max_turns)
+        conversation.summary = doc.get('summary') or ""
+        conversation.summary_tokens = estimate_tokens(conversation.summary) if conversation.summary else 0
+        for turn in doc.get('turns') or []:
+            if turn.get('role') in ('user', 'model') and turn.get('text'):
+                conversation.append(turn['role'], turn['text'])
+        return conversation
+
+
+class ConversationStore:
+    def __init__(self, db_client=None, summarizer: Optional[Callable[[str, List[Tuple[str, str]]], Awaitable[str]]] = None,
+                 max_turns: int = 12, token_budget: int = 1500, compact_threshold: int = 2000, keep_recent: int = 4,
+                 max_conversations: int = 2000, ttl_seconds: int = 604800):
+        self.db_client = db_client
+        self.summarizer = summarizer
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.compact_threshold = compact_threshold
+        self.keep_recent = keep_recent
+        self.max_conversations = max_conversations
+        self.ttl_seconds = ttl_seconds
+        self.compactions = 0
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._background: Set[asyncio.Task] = set()
+
+    async def setup(self):
+        if self.db_client:
+            await self.db_client.ensure_conversation_indexes(self.ttl_seconds)
+
+    async def _get(self, key: str) -> Conversation:
+        conversation = self._conversations.get(key)
+        if conversation is not None:
+            self._conversations.move_to_end(key)
+            return conversation
+
+        loading = self._loading.get(key)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            doc = await self.db_client.load_conversation(key) if self.db_client else None
+            conversation = Conversation.from_document(doc, self.max_turns) if doc else Conversation(self.max_turns)
+            self._conversations[key] = conversation
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+            future.set_result(conversation)
+            return conversation
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+
+    async def get_context(self, key: str) -> ConversationContext:
+        conversation = await self._get(key)
+        budget = self.token_budget - conversation.summary_tokens
+        selected: List[Tuple[str, str]] = []
+        turns = list(conversation.turns)
+        index = len(turns) - 1
+        while index >= 1 and budget > 0:
+            user_turn, model_turn = turns[index - 1], turns[index]
+            pair_tokens = user_turn[2] + model_turn[2]
+            if pair_tokens > budget or user_turn[0] != 'user' or model_turn[0] != 'model':
+                break
+            selected[:0] = [(user_turn[0], user_turn[1]), (model_turn[0], model_turn[1])]
+            budget -= pair_tokens
+            index -= 2
+        return ConversationContext(conversation.summary, selected)
+
+    async def record(self, key: str, user_text: str, ai_text: str):
+        conversation = await self._get(key)
+        if len(conversation.turns) >= 2 and conversation.turns[-2][1] == user_text[:MAX_TURN_CHARS]:
+            return
+        conversation.append('user', user_text)
+        conversation.append('model', ai_text)
+        self._mark_dirty(key, conversation)
+
+        over_budget = conversation.total_tokens > self.compact_threshold
+        nearly_full = len(conversation.turns) >= self.max_turns - 1
+        if (over_budget or nearly_full) and self.summarizer and not conversation.compacting:
+            conversation.compacting = True
+            task = asyncio.create_task(self._compact(key, conversation))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def _mark_dirty(self, key: str, conversation: Conversation):
+        if self.db_client:
+            self.db_client.save_conversation(conversation.to_document(key))
+
+    async def _compact(self, key: str, conversation: Conversation):
+        try:
+            compact_count = len(conversation.turns) - self.keep_recent
+            compact_count -= compact_count % 2
+            if compact_count <= 0:
+                return
+            old_entries = list(conversation.turns)[:compact_count]
+            old_turns = [(role, text) for role, text, _ in old_entries]
+            started = time.monotonic()
+            summary = (await self.summarizer(conversation.summary, old_turns)).strip()
+            if not summary:
+                return
+
+            compacted_ids = {id(entry) for entry in old_entries}
+            while conversation.turns and id(conversation.turns[0]) in compacted_ids:
+                conversation.turns.popleft()
+            conversation.summary = summary
+            conversation.summary_tokens = estimate_tokens(summary)
+            self.compactions += 1
+            self._mark_dirty(key, conversation)
+            logger.debug(f"Compacted {compact_count} turn(s) of conversation {key} in {time.monotonic() - started:.2f}s.")
+        except Exception as e:
+            logger.warning(f"Failed to compact conversation {key}: {type(e).__name__}: {e}")
+        finally:
+            conversation.compacting = False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'conversations': len(self._conversations),
+            'compactions': self.compactions,
+        }
+
+    async def close(self):
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
@@ -0,0 +1,189 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from utils.response_cache import instructions_hash
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INSTRUCTIONS = "You are a helpful AI assistant."
+
+class InstructionProfile:
+    __slots__ = ('name', 'text', 'digest')
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self.digest = instructions_hash(text)
+
+
+DEFAULT_PROFILE = InstructionProfile("default", DEFAULT_INSTRUCTIONS)
+
+
+class _ProfileEntry:
+    __slots__ = ('source', 'mode', 'loaded_at', 'base_digest', 'profile')
+
+    def __init__(self, source: Optional[str], mode: str, loaded_at: float):
+        self.source = source
+        self.mode = mode
+        self.loaded_at = loaded_at
+        self.base_digest: Optional[str] = None
+        self.profile: Optional[InstructionProfile] = None
+
+
+class InstructionsManager:
+    def __init__(self, path: str = "instructions.txt", db_client=None, poll_interval: float = 2.0, max_profiles: int = 64, profile_ttl: float = 300.0):
+        self.path = path
+        self.db_client = db_client
+        self.poll_interval = poll_interval
+        self.max_profiles = max_profiles
+        self.profile_ttl = profile_ttl
+        self.base = DEFAULT_PROFILE
+        self.reloads = 0
+        self.hits = 0
+        self.misses = 0
+        self._mtime: Optional[float] = None
+        self._profiles: "OrderedDict[str, _ProfileEntry]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._refresh_tasks: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def _stat(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _read(self) -> Tuple[Optional[float], Optional[str]]:
+        mtime = self._stat()
+        if mtime is None:
+            return None, None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return mtime, f.read().strip()
+
+    async def load(self) -> bool:
+        try:
+            mtime, text = await asyncio.to_thread(self._read)
+        except Exception as e:
+            logger.exception(f"Error loading {self.path}, keeping the current instructions: {e}")
+            return False
+
+        if text is None:
+            logger.error(f"{self.path} not found. Using basic AI fallback prompt.")
+        elif not text:
+            logger.warning(f"{self.path} is empty or contains only whitespace. Using basic AI fallback prompt.")
+        self._mtime = mtime
+        profile = InstructionProfile("default", text or DEFAULT_INSTRUCTIONS)
+        if profile.digest == self.base.digest:
+            return False
+        self.base = profile
+        self.reloads += 1
+        logger.info(f"Instructions loaded from {self.path} (version {profile.digest}, {len(profile.text)} chars).")
+        return True
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                mtime = await asyncio.to_thread(self._stat)
+            except Exception as e:
+                logger.debug(f"Could not stat {self.path}: {e}")
+                continue
+            if mtime != self._mtime:
+                await self.load()
+
+    def _compile(self, name: str, entry: _ProfileEntry) -> InstructionProfile:
+        if entry.profile is None or entry.base_digest != self.base.digest:
+            if entry.source is None:
+                entry.profile = self.base
+            elif entry.mode == "replace":
+                entry.profile = InstructionProfile(name, entry.source)
+            else:
+                entry.profile = InstructionProfile(name, f"{self.base.text}\n\n{entry.source}")
+            entry.base_digest = self.base.digest
+        return entry.profile
+
+    async def resolve(self, settings: Optional[Dict[str, Any]]) -> InstructionProfile:
+        name = settings.get('instructions_profile') if settings else None
+        if not name or not isinstance(name, str) or self.db_client is None:
+            return self.base
+
+        entry = self._profiles.get(name)
+        if entry is None:
+            self.misses += 1
+            entry = await self._fetch(name)
+        else:
+            self.hits += 1
+            self._profiles.move_to_end(name)
+            if time.monotonic() - entry.loaded_at > self.profile_ttl and name not in self._pending:
+                task = asyncio.create_task(self._fetch(name))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+        return self._compile(name, entry)
+
+    async def _fetch(self, name: str) -> _ProfileEntry:
+        pending = self._pending.get(name)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[name] = future
+        try:
+            doc = None
+            cache = True
+            try:
+                doc = await self.db_client.load_instruction_profile(name)
+            except Exception as e:
+                logger.error(f"Error loading instruction profile '{name}': {e}")
+                stale = self._profiles.get(name)
+                if stale is not None:
+                    stale.loaded_at = time.monotonic()
+                    future.set_result(stale)
+                    return stale
+                cache = False
+            else:
+                if doc is None:
+                    logger.warning(f"Instruction profile '{name}' not found, using the default instructions.")
+            source = doc.get('instructions') if doc else None
+            entry = _ProfileEntry(
+                source.strip() if isinstance(source, str) and source.strip() else None,
+                "replace" if doc and doc.get('mode') == "replace" else "append",
+                time.monotonic()
+            )
+            if cache:
+                self._profiles[name] = entry
+                self._profiles.move_to_end(name)
+                while len(self._profiles) > self.max_profiles:
+                    self._profiles.popitem(last=False)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            self._pending.pop(name, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'version': self.base.digest,
+            'reloads': self.reloads,
+            'profiles': len(self._profiles),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    async def close(self):
+        tasks = [task for task in (self._task, *self._refresh_tasks) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
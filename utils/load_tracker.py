@@ -0,0 +1,141 @@
+import time
+import math
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SlidingWindowCounter:
+    def __init__(self, window: float = 60.0, resolution: float = 1.0):
+        self.window = window
+        self.resolution = resolution
+        self._size = max(1, int(math.ceil(window / resolution)))
+        self._counts: List[int] = [0] * self._size
+        self._slots: List[int] = [-1] * self._size
+
+    def add(self, amount: int = 1, now: Optional[float] = None):
+        slot = int((time.monotonic() if now is None else now) / self.resolution)
+        index = slot % self._size
+        if self._slots[index] != slot:
+            self._slots[index] = slot
+            self._counts[index] = 0
+        self._counts[index] += amount
+
+    def total(self, now: Optional[float] = None) -> int:
+        current = int((time.monotonic() if now is None else now) / self.resolution)
+        oldest = current - self._size + 1
+        return sum(count for slot, count in zip(self._slots, self._counts) if oldest <= slot <= current)
+
+    def rate_per_minute(self, now: Optional[float] = None) -> float:
+        return self.total(now) * 60.0 / self.window
+
+
+class SlidingWindowLatency:
+    def __init__(self, window: float = 60.0, max_samples: int = 2048):
+        self.window = window
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=max_samples)
+
+    def observe(self, seconds: float, now: Optional[float] = None):
+        self._samples.append((time.monotonic() if now is None else now, seconds))
+
+    def _prune(self, now: float):
+        cutoff = now - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def percentile(self, q: float, now: Optional[float] = None) -> Optional[float]:
+        self._prune(time.monotonic() if now is None else now)
+        if not self._samples:
+            return None
+        values = sorted(seconds for _, seconds in self._samples)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class LoadTracker:
+    LOW, MEDIUM, HIGH = "low", "medium", "high"
+
+    def __init__(self, queue_depth: Optional[Callable[[], int]] = None, window: float = 60.0,
+                 medium_rate: float = 5, high_rate: float = 15,
+                 degrade_p95: float = 20.0, recover_p95: float = 8.0,
+                 degrade_queue: int = 60, recover_queue: int = 20,
+                 min_dwell: float = 30.0, min_samples: int = 5, evaluate_interval: float = 1.0):
+        self.queue_depth = queue_depth
+        self.medium_rate = medium_rate
+        self.high_rate = high_rate
+        self.degrade_p95 = degrade_p95
+        self.recover_p95 = recover_p95
+        self.degrade_queue = degrade_queue
+        self.recover_queue = recover_queue
+        self.min_dwell = min_dwell
+        self.min_samples = min_samples
+        self.evaluate_interval = evaluate_interval
+        self.requests = SlidingWindowCounter(window)
+        self.latency = SlidingWindowLatency(window)
+        self.degraded = False
+        self.times_degraded = 0
+        self.shed = 0
+        self._changed_at = float('-inf')
+        self._evaluated_at = 0.0
+
+    def record_request(self):
+        self.requests.add()
+
+    def record_latency(self, seconds: float):
+        self.latency.observe(seconds)
+
+    def _current_queue_depth(self) -> int:
+        if self.queue_depth is None:
+            return 0
+        try:
+            return self.queue_depth()
+        except Exception:
+            return 0
+
+    def is_degraded(self) -> bool:
+        now = time.monotonic()
+        if now - self._evaluated_at >= self.evaluate_interval:
+            self._evaluated_at = now
+            self._evaluate(now)
+        return self.degraded
+
+    def _evaluate(self, now: float):
+        p95 = self.latency.percentile(0.95, now) if len(self.latency) >= self.min_samples else None
+        depth = self._current_queue_depth()
+        if now - self._changed_at < self.min_dwell:
+            return
+
+        if not self.degraded:
+            if (p95 is not None and p95 >= self.degrade_p95) or depth >= self.degrade_queue:
+                self.degraded = True
+                self.times_degraded += 1
+                self._changed_at = now
+                logger.warning(f"Entering degraded mode (p95 {p95 or 0:.1f}s, queue depth {depth}).")
+        elif (p95 is None or p95 <= self.recover_p95) and depth <= self.recover_queue:
+            self.degraded = False
+            self._changed_at = now
+            logger.info(f"Leaving degraded mode (p95 {p95 or 0:.1f}s, queue depth {depth}).")
+
+    def usage_level(self) -> str:
+        if self.degraded:
+            return self.HIGH
+        rate = self.requests.rate_per_minute()
+        if rate >= self.high_rate:
+            return self.HIGH
+        if rate >= self.medium_rate:
+            return self.MEDIUM
+        return self.LOW
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(0.95)
+        return {
+            'rate_per_minute': round(self.requests.rate_per_minute(), 1),
+            'p95_ms': round(p95 * 1000) if p95 is not None else 0,
+            'queue_depth': self._current_queue_depth(),
+            'degraded': self.degraded,
+            'times_degraded': self.times_degraded,
+            'shed': self.shed,
+        }
@@ -0,0 +1,141 @@
+import os
+import sys
+import copy
+import json
+import queue
+import random
+import logging
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Optional
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar('request_id', default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+_exception_formatter = logging.Formatter()
+
+def set_request_id(request_id) -> contextvars.Token:
+    return request_id_var.set(str(request_id))
+
+def get_request_id() -> str:
+    return request_id_var.get()
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.threshold = int(rate * 10000)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        request_id = getattr(record, 'request_id', "-")
+        if request_id != "-":
+            return hash(request_id) % 10000 < self.threshold
+        return random.random() < self.rate
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', "-"),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _build_file_handler(log_file: str) -> logging.Handler:
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    rotate_when = os.getenv("LOG_ROTATE_WHEN", "").strip()
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count, encoding='utf-8', utc=True)
+    return logging.handlers.RotatingFileHandler(log_file, maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))), backupCount=backup_count, encoding='utf-8')
+
+def setup_logging(log_dir: str = "logs"):
+    global _listener, _queue_handler
+    os.makedirs(log_dir, exist_ok=True)
+    json_lines = os.getenv("LOG_FORMAT", "text").lower() == "json"
+    log_file = os.path.join(log_dir, "scriptly.jsonl" if json_lines else "scriptly.log")
+    log_level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+
+    if json_lines:
+        log_format = JsonFormatter()
+    else:
+        log_format = logging.Formatter(
+            '%(asctime)s [%(levelname)-8s] %(name)-20s [%(request_id)s]: %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+
+    handlers = []
+    try:
+        file_handler = _build_file_handler(log_file)
+        file_handler.setFormatter(log_format)
+        handlers.append(file_handler)
+    except Exception as e:
+        print(f"Error setting up file logging handler: {e}", file=sys.stderr)
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(log_format)
+    handlers.append(console_handler)
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    _queue_handler.addFilter(RequestIdFilter())
+    _queue_handler.addFilter(DebugSampler(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
+    root_logger.addHandler(_queue_handler)
+
+    logging.getLogger("discord.http").setLevel(logging.WARNING)
+    logging.getLogger("discord.gateway").setLevel(logging.WARNING)
+    logging.getLogger("discord.client").setLevel(logging.INFO)
+
+    print(f"Logging setup complete. Level: {logging.getLevelName(log_level)}. Log file: {log_file}")
+    logging.info("-------------------- Bot Start --------------------")
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None and _queue_handler.dropped:
+        print(f"Dropped {_queue_handler.dropped} log record(s) because the log queue was full.", file=sys.stderr)
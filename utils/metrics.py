@@ -0,0 +1,261 @@
+import time
+import bisect
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + list(self._samples())
+
+    def _samples(self) -> Iterable[str]:
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        self._functions[self._key(labels)] = function
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        function = self._functions.get(key)
+        return function() if function else self._values.get(key, 0)
+
+    def _samples(self) -> Iterable[str]:
+        values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class _HistogramSeries:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series: Dict[Tuple[str, ...], _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        if labels:
+            series = [self._series.get(self._key(labels))]
+        else:
+            series = list(self._series.values())
+        counts = [0] * len(self.buckets)
+        for entry in series:
+            if entry is None:
+                continue
+            for index, count in enumerate(entry.counts):
+                counts[index] += count
+        total = sum(counts)
+        if not total:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                if upper == float('inf'):
+                    return lower
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-2]
+
+    def _samples(self) -> Iterable[str]:
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series.sum)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {series.count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+MENTIONS = REGISTRY.counter("scriptly_mentions_total", "AI mentions received.", ("guild_bucket",))
+COMMANDS = REGISTRY.counter("scriptly_commands_total", "Prefix and application commands completed.", ("command",))
+CACHE_HITS = REGISTRY.counter("scriptly_cache_hits_total", "Response cache hits by tier.", ("tier",))
+CACHE_MISSES = REGISTRY.counter("scriptly_cache_misses_total", "Response cache lookups that missed every tier.")
+SINGLEFLIGHT_COALESCED = REGISTRY.counter("scriptly_singleflight_coalesced_total", "Requests that joined an identical in-flight Gemini call instead of making their own.")
+RESPONSES = REGISTRY.counter("scriptly_responses_total", "Mention outcomes (ok, cached, similar, blocked, error, busy, rate_limited, restricted, shed, too_large, over_budget).", ("outcome", "guild_bucket"))
+
+GEMINI_LATENCY = REGISTRY.histogram("scriptly_gemini_request_seconds", "Gemini call latency, including streaming until the last chunk.", ("mode", "outcome"))
+DISCORD_SEND_LATENCY = REGISTRY.histogram("scriptly_discord_send_seconds", "Discord reply, edit and attachment send latency.", ("kind",))
+MONGO_LATENCY = REGISTRY.histogram("scriptly_mongo_operation_seconds", "MongoDB operation latency.", ("operation",))
+MENTION_LATENCY = REGISTRY.histogram("scriptly_mention_seconds", "End-to-end latency from mention to reply.", ("outcome",))
+
+AI_IN_FLIGHT = REGISTRY.gauge("scriptly_ai_in_flight", "Gemini calls currently in flight.")
+AI_QUEUE_DEPTH = REGISTRY.gauge("scriptly_ai_queue_depth", "Jobs waiting in the AI scheduler queue.")
+DEGRADED = REGISTRY.gauge("scriptly_degraded", "1 while the bot is shedding load in degraded mode.")
+
+_guild_buckets = 16
+
+def configure_guild_buckets(count: int):
+    global _guild_buckets
+    _guild_buckets = max(0, count)
+
+def guild_bucket(guild_id: Optional[int]) -> str:
+    if guild_id is None:
+        return "dm"
+    if _guild_buckets <= 0:
+        return "all"
+    return str(guild_id % _guild_buckets)
+
+
+class MetricsServer:
+    def __init__(self, registry: Registry = REGISTRY, host: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        app.router.add_get("/healthz", self._handle_health)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,212 @@
+import re
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    'user': (6.0, 3),
+    'channel': (20.0, 8),
+    'guild': (60.0, 20),
+    'notice': (2.0, 1),
+}
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate_per_minute: float, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    def configure(self, rate_per_minute: float, capacity: int):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, capacity)
+        self.tokens = min(self.tokens, float(self.capacity))
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(float(self.capacity), self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def retry_after(self, tokens: float = 1.0, now: Optional[float] = None) -> float:
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= tokens:
+            return 0.0
+        if self.rate <= 0:
+            return float('inf')
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float = 1.0, now: Optional[float] = None) -> bool:
+        if self.retry_after(tokens, now) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class RateLimiter:
+    def __init__(self, default_limits: Optional[Dict[str, Tuple[float, int]]] = None, max_buckets: int = 10000):
+        self.default_limits = dict(DEFAULT_RATE_LIMITS)
+        self.default_limits.update(default_limits or {})
+        self.max_buckets = max_buckets
+        self.limited = 0
+        self._buckets: "OrderedDict[Tuple[str, Hashable], TokenBucket]" = OrderedDict()
+
+    def limits_for(self, scope: str, settings: Optional[Dict[str, Any]] = None) -> Tuple[float, int]:
+        rate, burst = self.default_limits[scope]
+        override = ((settings or {}).get('rate_limits') or {}).get(scope)
+        if isinstance(override, dict):
+            rate = float(override.get('per_minute', rate))
+            burst = int(override.get('burst', burst))
+        return rate, burst
+
+    def _bucket(self, scope: str, key: Hashable, settings: Optional[Dict[str, Any]]) -> TokenBucket:
+        rate, burst = self.limits_for(scope, settings)
+        bucket_key = (scope, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = TokenBucket(rate, burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            if bucket.rate != rate / 60.0 or bucket.capacity != burst:
+                bucket.configure(rate, burst)
+            self._buckets.move_to_end(bucket_key)
+        return bucket
+
+    def acquire(self, checks: List[Tuple[str, Hashable]], settings: Optional[Dict[str, Any]] = None) -> float:
+        now = time.monotonic()
+        buckets = [self._bucket(scope, key, settings) for scope, key in checks]
+        wait = max((bucket.retry_after(1.0, now) for bucket in buckets), default=0.0)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket.consume(1.0, now)
+        return 0.0
+
+    def check_mention(self, user_id: int, channel_id: int, guild_id: Optional[int], settings: Optional[Dict[str, Any]] = None) -> float:
+        checks = [('user', user_id), ('channel', channel_id)]
+        if guild_id is not None:
+            checks.append(('guild', guild_id))
+        wait = self.acquire(checks, settings)
+        if wait > 0:
+            self.limited += 1
+        return wait
+
+    def allow_notice(self, user_id: int, settings: Optional[Dict[str, Any]] = None) -> bool:
+        return self.acquire([('notice', user_id)], settings) == 0.0
+
+    def stats(self) -> Dict[str, int]:
+        return {'buckets': len(self._buckets), 'limited': self.limited}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+_RETRY_DELAY_RE = re.compile(r"retry[_ ]delay\s*\{\s*seconds:\s*(\d+)|retry in\s*([\d.]+)\s*s", re.IGNORECASE)
+
+def parse_retry_after(error: Exception) -> Optional[float]:
+    for detail in getattr(error, 'details', None) or []:
+        retry_delay = getattr(detail, 'retry_delay', None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    match = _RETRY_DELAY_RE.search(str(error))
+    if match:
+        return float(match.group(1) or match.group(2))
+    return None
+
+RATE_LIMIT_ERROR_TYPES = ("ResourceExhausted", "TooManyRequests")
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if getattr(error, 'code', None) == 429 or getattr(error, 'status_code', None) == 429:
+        return True
+    return type(error).__name__ in RATE_LIMIT_ERROR_TYPES
+
+def is_timeout_error(error: Exception) -> bool:
+    return isinstance(error, asyncio.TimeoutError) or getattr(error, 'code', None) == 504
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, base_backoff: float = 5.0, max_backoff: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._open_streak = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self._open_until - time.monotonic())
+
+    def before_call(self):
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN and self.retry_after() <= 0:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+            logger.info("Circuit breaker half-open, allowing a probe request.")
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(max(self.retry_after(), 1.0))
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit breaker closed after a successful probe.")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._open_streak = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        if self.state == self.OPEN:
+            return
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self._open_streak += 1
+            self._open(retry_after)
+        elif self.consecutive_failures >= self.failure_threshold:
+            self._open(retry_after)
+
+    def record_neutral(self):
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = False
+
+    def _open(self, retry_after: Optional[float]):
+        backoff = self.base_backoff * (2 ** min(self._open_streak, 16)) * random.uniform(0.8, 1.2)
+        if retry_after:
+            backoff = max(backoff, retry_after * random.uniform(1.0, 1.2))
+        backoff = min(self.max_backoff, backoff)
+        self.times_opened += 1
+        self.state = self.OPEN
+        self._open_until = time.monotonic() + backoff
+        self._probe_in_flight = False
+        logger.warning(f"Circuit breaker opened for {backoff:.1f}s after {self.consecutive_failures} consecutive failure(s).")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened,
+            'rejected': self.rejected,
+            'retry_after': round(self.retry_after(), 1),
+        }
@@ -0,0 +1,116 @@
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from utils.metrics import CACHE_HITS, CACHE_MISSES
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s?!.]+$")
+
+def normalize_message(user_message: str) -> str:
+    normalized = _WHITESPACE_RE.sub(" ", user_message.strip().lower())
+    return _TRAILING_PUNCTUATION_RE.sub("", normalized)
+
+def instructions_hash(instructions: str) -> str:
+    return hashlib.sha256(instructions.encode('utf-8')).hexdigest()[:16]
+
+def make_cache_key(user_message: str, instructions_digest: str, context_digest: str = "") -> str:
+    material = f"{instructions_digest}:{context_digest}:{normalize_message(user_message)}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: str) -> Optional[Any]:
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        self._entries.clear()
+
+
+class ResponseCache:
+    def __init__(self, db_client=None, max_size: int = 1024, ttl: int = 21600):
+        self.db_client = db_client
+        self.ttl = ttl
+        self.l1 = LRUCache(max_size=max_size, ttl=ttl)
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self._pending_writes: Set[asyncio.Task] = set()
+
+    async def setup(self):
+        if self.db_client:
+            await self.db_client.ensure_response_cache_indexes()
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self.l1.get(key)
+        if value is not None:
+            self.l1_hits += 1
+            CACHE_HITS.inc(tier="l1")
+            return value
+
+        if self.db_client:
+            value = await self.db_client.get_cached_response(key)
+            if value is not None:
+                self.l2_hits += 1
+                CACHE_HITS.inc(tier="l2")
+                self.l1.set(key, value)
+                return value
+
+        self.misses += 1
+        CACHE_MISSES.inc()
+        return None
+
+    def set(self, key: str, value: str):
+        self.l1.set(key, value)
+        if self.db_client:
+            task = asyncio.create_task(self.db_client.set_cached_response(key, value, self.ttl))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    def stats(self) -> Dict[str, int]:
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            'l1_hits': self.l1_hits,
+            'l2_hits': self.l2_hits,
+            'misses': self.misses,
+            'hit_rate_pct': round(100 * (self.l1_hits + self.l2_hits) / lookups) if lookups else 0,
+            'l1_size': len(self.l1),
+        }
+
+    async def close(self):
+        if self._pending_writes:
+            logger.info(f"Waiting for {len(self._pending_writes)} pending cache write(s)...")
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
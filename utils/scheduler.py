@@ -0,0 +1,128 @@
+import time
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List
+
+logger = logging.getLogger(__name__)
+
+class SchedulerBusy(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('key', 'factory', 'future', 'context', 'enqueued_at')
+
+    def __init__(self, key: Hashable, factory: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.key = key
+        self.factory = factory
+        self.future = future
+        self.context = contextvars.copy_context()
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int = 8, max_queue_size: int = 100, max_per_key: int = 10, wait_window: int = 256):
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.max_per_key = max_per_key
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self._queues: Dict[Hashable, Deque[_Job]] = {}
+        self._ring: Deque[Hashable] = deque()
+        self._depth = 0
+        self._ready = asyncio.Semaphore(0)
+        self._workers: List[asyncio.Task] = []
+        self._recent_waits: Deque[float] = deque(maxlen=wait_window)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._depth
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_concurrency)]
+        logger.info(f"FairScheduler started with {self.max_concurrency} worker(s), queue limit {self.max_queue_size} (per key {self.max_per_key}).")
+
+    def submit(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        queue = self._queues.get(key)
+        if self._depth >= self.max_queue_size or (queue is not None and len(queue) >= self.max_per_key):
+            self.rejected += 1
+            logger.warning(f"Scheduler rejected request for {key}. Depth: {self._depth}, key depth: {len(queue) if queue else 0}")
+            raise SchedulerBusy(key)
+
+        future = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ring.append(key)
+        queue.append(_Job(key, factory, future))
+        self._depth += 1
+        self._ready.release()
+        return future
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self.submit(key, factory)
+        return await future
+
+    def _next_job(self) -> _Job:
+        key = self._ring.popleft()
+        queue = self._queues[key]
+        job = queue.popleft()
+        if queue:
+            self._ring.append(key)
+        else:
+            del self._queues[key]
+        self._depth -= 1
+        return job
+
+    async def _worker(self, worker_id: int):
+        while True:
+            await self._ready.acquire()
+            job = self._next_job()
+            if job.future.done():
+                continue
+
+            self._recent_waits.append(time.monotonic() - job.enqueued_at)
+            self.in_flight += 1
+            try:
+                result = await job.context.run(asyncio.ensure_future, job.factory())
+                if not job.future.done():
+                    job.future.set_result(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self.in_flight -= 1
+                self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._recent_waits)
+        return {
+            'queue_depth': self._depth,
+            'queued_keys': len(self._queues),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'wait_avg_ms': round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            'wait_p95_ms': round(1000 * waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+            'wait_max_ms': round(1000 * waits[-1], 1) if waits else 0.0,
+        }
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        while self._ring:
+            job = self._next_job()
+            if not job.future.done():
+                job.future.cancel()
+        logger.info("FairScheduler stopped.")
@@ -0,0 +1,254 @@
+import re
+import time
+import heapq
+import asyncio
+import hashlib
+import logging
+from array import array
+from datetime import timezone
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from utils.response_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[\w.:]+")
+NUMBER_RE = re.compile(r"^\d+(?:\.\d+)?$")
+STOPWORDS = frozenset(
+    "a an the it its is are was were be been am please just so that this these those".split()
+)
+
+def canonical_text(normalized: str) -> str:
+    return " ".join(word for word in WORD_RE.findall(normalized) if word.strip(".:") not in STOPWORDS)
+
+def key_terms(normalized: str) -> FrozenSet[str]:
+    terms = set()
+    for word in WORD_RE.findall(normalized):
+        word = word.strip(".:")
+        if NUMBER_RE.match(word) or (any(char.isdigit() for char in word) and any(char.isalpha() for char in word)) or any(char in word for char in "_.:"):
+            terms.add(word)
+    return frozenset(terms)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, shingle_size: int = 4):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.version = f"shake128c:{num_perm}:{shingle_size}"
+        self._digest_size = 4 * num_perm
+
+    def shingles(self, normalized: str) -> Set[str]:
+        size = self.shingle_size
+        if len(normalized) <= size:
+            return {normalized}
+        return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+    def signature(self, normalized: str) -> array:
+        rows = [array('I', hashlib.shake_128(shingle.encode('utf-8')).digest(self._digest_size)) for shingle in self.shingles(canonical_text(normalized) or normalized)]
+        return array('I', map(min, zip(*rows)))
+
+
+class SimilarMatch:
+    __slots__ = ('answer', 'question', 'similarity')
+
+    def __init__(self, answer: str, question: str, similarity: float):
+        self.answer = answer
+        self.question = question
+        self.similarity = similarity
+
+
+class SimilarityIndex:
+    def __init__(self, db_client=None, capacity: int = 5000, threshold: float = 0.8, num_perm: int = 64, bands: int = 16,
+                 ttl: int = 21600, max_answer_chars: int = 8000, shingle_size: int = 4, max_candidates: int = 8,
+                 max_question_chars: int = 1000, offload_chars: int = 300):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.db_client = db_client
+        self.capacity = capacity
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ttl = ttl
+        self.max_answer_chars = max_answer_chars
+        self.max_candidates = max_candidates
+        self.max_question_chars = max_question_chars
+        self.offload_chars = offload_chars
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.num_perm = num_perm
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+        self.rejected = 0
+
+        self._signatures = array('I', bytes(4 * capacity * num_perm))
+        self._expires_at = array('d', bytes(8 * capacity))
+        self._questions: List[Optional[str]] = [None] * capacity
+        self._answers: List[Optional[str]] = [None] * capacity
+        self._scopes: List[Optional[str]] = [None] * capacity
+        self._terms: List[Optional[FrozenSet[str]]] = [None] * capacity
+        self._slots: Dict[Tuple[str, str], int] = {}
+        self._buckets: Dict[int, List[int]] = {}
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _band_keys(self, scope: str, signature: array) -> List[int]:
+        raw = signature.tobytes()
+        width = 4 * self.rows
+        return [hash((scope, band, raw[band * width:(band + 1) * width])) for band in range(self.bands)]
+
+    def _slot_signature(self, slot: int) -> array:
+        start = slot * self.num_perm
+        return self._signatures[start:start + self.num_perm]
+
+    def _evict(self, slot: int):
+        question = self._questions[slot]
+        if question is None:
+            return
+        scope = self._scopes[slot]
+        for key in self._band_keys(scope, self._slot_signature(slot)):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                try:
+                    bucket.remove(slot)
+                except ValueError:
+                    pass
+                if not bucket:
+                    del self._buckets[key]
+        self._slots.pop((scope, question), None)
+        self._questions[slot] = None
+        self._answers[slot] = None
+        self._scopes[slot] = None
+        self._terms[slot] = None
+        self._size -= 1
+
+    def _insert(self, scope: str, question: str, signature, answer: str, expires_at: float):
+        slot = self._slots.get((scope, question))
+        if slot is None:
+            slot = self._next
+            self._next = (self._next + 1) % self.capacity
+            if self._questions[slot] is not None:
+                self._evict(slot)
+                self.evictions += 1
+            self._size += 1
+            self._slots[(scope, question)] = slot
+            self._questions[slot] = question
+            self._scopes[slot] = scope
+            self._terms[slot] = key_terms(question)
+            self._signatures[slot * self.num_perm:(slot + 1) * self.num_perm] = signature
+            for key in self._band_keys(scope, signature):
+                self._buckets.setdefault(key, []).append(slot)
+        self._answers[slot] = answer
+        self._expires_at[slot] = expires_at
+
+    def _question(self, user_message: str) -> Optional[str]:
+        if len(user_message) > 2 * self.max_question_chars:
+            self.skipped += 1
+            return None
+        question = normalize_message(user_message)
+        if not question:
+            return None
+        if len(question) > self.max_question_chars:
+            self.skipped += 1
+            return None
+        return question
+
+    async def _signature(self, question: str) -> array:
+        if len(question) > self.offload_chars:
+            return await asyncio.to_thread(self.hasher.signature, question)
+        return self.hasher.signature(question)
+
+    async def add(self, user_message: str, answer: str, scope: str = "") -> bool:
+        question = self._question(user_message)
+        if question is None or not answer or len(answer) > self.max_answer_chars:
+            return False
+        signature = await self._signature(question)
+        expires_at = time.time() + self.ttl
+        self._insert(scope, question, signature, answer, expires_at)
+        if self.db_client:
+            self.db_client.save_similar_question(scope, question, self.hasher.version, signature.tobytes(), answer, self.ttl)
+        return True
+
+    async def lookup(self, user_message: str, scope: str = "") -> Optional[SimilarMatch]:
+        question = self._question(user_message)
+        if question is None or not self._size:
+            return None
+        now = time.time()
+        exact = self._slots.get((scope, question))
+        if exact is not None and self._expires_at[exact] > now:
+            self.hits += 1
+            return SimilarMatch(self._answers[exact], question, 1.0)
+
+        signature = await self._signature(question)
+        terms = key_terms(question)
+        band_hits: Dict[int, int] = {}
+        for key in self._band_keys(scope, signature):
+            for slot in self._buckets.get(key, ()):
+                band_hits[slot] = band_hits.get(slot, 0) + 1
+
+        best_slot, best_score = -1, 0.0
+        for slot in heapq.nlargest(self.max_candidates, band_hits, key=band_hits.__getitem__):
+            if self._expires_at[slot] <= now or self._scopes[slot] != scope:
+                continue
+            if self._terms[slot] != terms:
+                self.rejected += 1
+                continue
+            score = sum(map(int.__eq__, signature, self._slot_signature(slot))) / self.num_perm
+            if score > best_score:
+                best_slot, best_score = slot, score
+
+        if best_slot < 0 or best_score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return SimilarMatch(self._answers[best_slot], self._questions[best_slot], best_score)
+
+    async def setup(self):
+        if not self.db_client:
+            return
+        await self.db_client.ensure_similar_question_indexes()
+        await self.rebuild()
+
+    async def rebuild(self):
+        if not self.db_client:
+            return
+        started = time.perf_counter()
+        loaded = 0
+        try:
+            documents = await self.db_client.load_similar_questions(self.hasher.version, self.capacity)
+        except Exception as e:
+            logger.error(f"Could not rebuild the similarity index from MongoDB: {e}")
+            return
+        for doc in reversed(documents):
+            signature = array('I')
+            signature.frombytes(doc['signature'])
+            if len(signature) != self.num_perm:
+                continue
+            expires_at = doc['expires_at']
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._insert(doc.get('scope', ""), doc['question'], signature, doc['answer'], expires_at.timestamp())
+            loaded += 1
+        logger.info(f"Similarity index rebuilt with {loaded} question(s) in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    def clear(self):
+        for slot in range(self.capacity):
+            self._evict(slot)
+        self._next = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': self._size,
+            'capacity': self.capacity,
+            'buckets': len(self._buckets),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate_pct': round(100 * self.hits / lookups) if lookups else 0,
+            'evictions': self.evictions,
+            'skipped': self.skipped,
+            'rejected': self.rejected,
+        }
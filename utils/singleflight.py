@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from utils.metrics import SINGLEFLIGHT_COALESCED
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def is_in_flight(self, key: Hashable) -> bool:
+        return key in self._in_flight
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            SINGLEFLIGHT_COALESCED.inc()
+            logger.debug(f"Coalesced request onto in-flight call {str(key)[:12]}. Total coalesced: {self.coalesced}")
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.leaders += 1
+        try:
+            result = await factory()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {'leaders': self.leaders, 'coalesced': self.coalesced, 'in_flight': self.in_flight}
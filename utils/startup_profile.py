@@ -0,0 +1,41 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class StartupProfiler:
+    def __init__(self, origin: Optional[float] = None):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.phases: List[Tuple[str, float, float]] = []
+
+    def record(self, name: str, started: float, ended: Optional[float] = None):
+        ended = ended if ended is not None else time.perf_counter()
+        self.phases.append((name, started - self.origin, ended - started))
+        logger.debug(f"Startup phase '{name}' took {(ended - started) * 1000:.0f} ms.")
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    @property
+    def elapsed(self) -> float:
+        return max((offset + duration for _, offset, duration in self.phases), default=0.0)
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {duration * 1000:.0f}ms" for name, _, duration in sorted(self.phases, key=lambda p: p[1]))
+
+    def report(self) -> str:
+        lines = [
+            "Startup profile (offsets from process start):",
+            f"  {'phase':<22}{'start':>10}{'duration':>10}",
+        ]
+        for name, offset, duration in sorted(self.phases, key=lambda p: p[1]):
+            lines.append(f"  {name:<22}{offset * 1000:>8.0f}ms{duration * 1000:>8.0f}ms")
+        lines.append(f"  {'total to READY':<22}{'':>10}{self.elapsed * 1000:>8.0f}ms")
+        return "\n".join(lines)
@@ -13,12 +13,16 @@ async def update_status_task(bot):
         level = discord.Status.online
         text = "Low Usage"
 
-        usage_count = getattr(bot, 'usage_count', 0)
+        load_tracker = getattr(bot, 'load_tracker', None)
+        usage_level = load_tracker.usage_level() if load_tracker else "low"
 
-        if usage_count >= 15:
+        if load_tracker and load_tracker.is_degraded():
+            level = discord.Status.dnd
+            text = "Heavy Load"
+        elif usage_level == "high":
             level = discord.Status.dnd
             text = "High Usage"
-        elif usage_count >= 5:
+        elif usage_level == "medium":
             level = discord.Status.idle
             text = "Medium Usage"
 
@@ -26,7 +30,6 @@ async def update_status_task(bot):
         try:
             await bot.change_presence(status=level, activity=activity)
             logger.debug(f"Presence updated: {level}, Activity: {text}")
-            bot.usage_count = 0
         except discord.errors.ConnectionClosed:
             logger.warning("Could not update presence: Connection was closed.")
         except Exception as e:
@@ -0,0 +1,143 @@
+import asyncio
+import discord
+import logging
+from typing import List, Optional
+
+from utils.chunked_reply import MAX_MESSAGE_LENGTH, build_attachment, take_chunk
+from utils.metrics import DISCORD_SEND_LATENCY
+
+logger = logging.getLogger(__name__)
+
+FILE_NOTE = "My response was too long, so I've attached it as a file:"
+
+class StreamingReply:
+    def __init__(self, message: discord.Message, footer: str = "", edit_interval: float = 1.2, max_length: int = MAX_MESSAGE_LENGTH, file_threshold: int = 10000):
+        self.message = message
+        self.footer = footer
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.file_threshold = file_threshold
+        self.reply: Optional[discord.Message] = None
+        self.messages: List[discord.Message] = []
+        self.edit_count = 0
+        self._parts: List[str] = []
+        self._length = 0
+        self._dirty = False
+        self._overflowed = False
+        self._sealed = 0
+        self._reopen: Optional[str] = None
+        self._published = ""
+        self._flusher: Optional[asyncio.Task] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def overflowed(self) -> bool:
+        return self._overflowed
+
+    def feed(self, chunk: str):
+        if not chunk:
+            return
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        if self._length + len(self.footer) > self.file_threshold:
+            if not self._overflowed:
+                logger.info("Streamed response exceeded the file threshold, will attach it as a file when finished.")
+            self._overflowed = True
+        else:
+            self._dirty = True
+
+    def _pending_text(self, text: str) -> str:
+        pending = text[self._sealed:]
+        return f"{self._reopen}\n{pending}" if self._reopen else pending
+
+    async def _send(self, content: str, **kwargs) -> discord.Message:
+        if not self.messages:
+            with DISCORD_SEND_LATENCY.time(kind="reply"):
+                sent = await self.message.reply(content, mention_author=False, allowed_mentions=discord.AllowedMentions.none(), **kwargs)
+        else:
+            with DISCORD_SEND_LATENCY.time(kind="chunk"):
+                sent = await self.message.channel.send(content, allowed_mentions=discord.AllowedMentions.none(), **kwargs)
+        self.messages.append(sent)
+        return sent
+
+    async def _publish(self, content: str):
+        if content == self._published:
+            return
+        if self.reply is None:
+            self.reply = await self._send(content)
+        else:
+            with DISCORD_SEND_LATENCY.time(kind="edit"):
+                await self.reply.edit(content=content, allowed_mentions=discord.AllowedMentions.none())
+            self.edit_count += 1
+        self._published = content
+
+    async def _sync(self, final: bool = False):
+        text = self.text
+        footer = self.footer if final else ""
+        while True:
+            pending = self._pending_text(text)
+            if len(pending) + len(footer) <= self.max_length:
+                break
+            chunk, consumed, open_fence = take_chunk(pending, self.max_length - len(footer))
+            await self._publish(chunk)
+            self._sealed += consumed - (len(self._reopen) + 1 if self._reopen else 0)
+            while self._sealed < len(text) and text[self._sealed] == "\n":
+                self._sealed += 1
+            self._reopen = open_fence
+            self.reply = None
+            self._published = ""
+
+        content = f"{pending}{footer}"
+        if content.strip():
+            await self._publish(content)
+
+    async def start(self, first_chunk: str):
+        self.feed(first_chunk)
+        if not self._overflowed:
+            await self._sync()
+        self._dirty = False
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.edit_interval)
+            if not self._dirty or self._overflowed:
+                continue
+            self._dirty = False
+            try:
+                await self._sync()
+            except discord.errors.NotFound:
+                logger.warning(f"Streamed reply in channel {self.message.channel.id} was deleted, stopping edits.")
+                return
+            except discord.errors.HTTPException as e:
+                logger.warning(f"Failed to edit streamed reply (HTTP {e.status}): {e.text}")
+
+    async def _stop_flusher(self):
+        if self._flusher is None:
+            return
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+        self._flusher = None
+
+    async def finish(self):
+        await self._stop_flusher()
+        if self._overflowed:
+            attachment = build_attachment(f"{self.text}{self.footer}")
+            if self.reply is not None:
+                with DISCORD_SEND_LATENCY.time(kind="file"):
+                    await self.reply.edit(content=FILE_NOTE, attachments=[attachment], allowed_mentions=discord.AllowedMentions.none())
+                self.edit_count += 1
+            else:
+                await self._send(FILE_NOTE, file=attachment)
+        elif self._length:
+            await self._sync(final=True)
+        logger.debug(f"Streamed reply finished after {self.edit_count} edit(s) across {len(self.messages)} message(s), {self._length} chars.")
+
+    async def abort(self):
+        await self._stop_flusher()
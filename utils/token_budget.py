@@ -0,0 +1,94 @@
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from utils.conversation import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+TRUNCATION_MARKER = "\n\n[... {removed} characters truncated ...]\n\n"
+
+
+class PromptTooLarge(Exception):
+    def __init__(self, tokens: int, limit: int):
+        super().__init__(f"Prompt is ~{tokens} tokens, limit is {limit}")
+        self.tokens = tokens
+        self.limit = limit
+
+
+class TokenUsage:
+    __slots__ = ('guild_id', 'input_tokens', 'output_tokens', 'exact', 'recorded')
+
+    def __init__(self, guild_id: Optional[int], input_tokens: int = 0):
+        self.guild_id = guild_id
+        self.input_tokens = input_tokens
+        self.output_tokens = 0
+        self.exact = False
+        self.recorded = False
+
+    def update_from(self, usage_metadata):
+        if not usage_metadata:
+            return
+        prompt_tokens = getattr(usage_metadata, 'prompt_token_count', 0)
+        output_tokens = getattr(usage_metadata, 'candidates_token_count', 0)
+        if prompt_tokens or output_tokens:
+            self.input_tokens = prompt_tokens or self.input_tokens
+            self.output_tokens = output_tokens
+            self.exact = True
+
+    def finish(self, output_text: str):
+        if not self.exact:
+            self.output_tokens = estimate_tokens(output_text)
+
+
+class TokenBudget:
+    def __init__(self, max_input_tokens: int = 8000, mode: str = "truncate", default_max_output_tokens: int = 0, exact_threshold: float = 0.8, token_counter=None):
+        self.max_input_tokens = max_input_tokens
+        self.mode = mode if mode in ("truncate", "reject") else "truncate"
+        self.default_max_output_tokens = default_max_output_tokens
+        self.exact_threshold = exact_threshold
+        self.token_counter = token_counter
+        self.truncated = 0
+        self.rejected = 0
+        self.exact_counts = 0
+
+    async def count(self, text: str) -> int:
+        estimate = estimate_tokens(text)
+        if self.token_counter is None or estimate < self.max_input_tokens * self.exact_threshold:
+            return estimate
+        try:
+            exact = await self.token_counter(text)
+            self.exact_counts += 1
+            return exact
+        except Exception as e:
+            logger.debug(f"Exact token count failed, using the estimate ({type(e).__name__}: {e})")
+            return estimate
+
+    async def fit(self, text: str) -> Tuple[str, int]:
+        if self.max_input_tokens <= 0:
+            return text, estimate_tokens(text)
+        tokens = await self.count(text)
+        if tokens <= self.max_input_tokens:
+            return text, tokens
+        if self.mode == "reject":
+            self.rejected += 1
+            raise PromptTooLarge(tokens, self.max_input_tokens)
+
+        keep = int(len(text) * self.max_input_tokens / tokens) - len(TRUNCATION_MARKER)
+        head = max(0, keep * 2 // 3)
+        tail = max(0, keep - head)
+        truncated = f"{text[:head]}{TRUNCATION_MARKER.format(removed=len(text) - head - tail)}{text[len(text) - tail:] if tail else ''}"
+        self.truncated += 1
+        logger.info(f"Truncated a ~{tokens} token prompt to ~{estimate_tokens(truncated)} tokens (limit {self.max_input_tokens}).")
+        return truncated, estimate_tokens(truncated)
+
+    def max_output_tokens(self, settings: Optional[Dict[str, Any]] = None, cap: Optional[int] = None) -> Optional[int]:
+        try:
+            limit = int((settings or {}).get('max_output_tokens') or 0) or self.default_max_output_tokens
+        except (TypeError, ValueError):
+            limit = self.default_max_output_tokens
+        if cap:
+            limit = min(limit, cap) if limit else cap
+        return int(limit) if limit else None
+
+    def stats(self) -> Dict[str, int]:
+        return {'max_input_tokens': self.max_input_tokens, 'truncated': self.truncated, 'rejected': self.rejected, 'exact_counts': self.exact_counts}
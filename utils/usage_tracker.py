@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from utils.token_budget import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+def utc_day() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+class _DailyUsage:
+    __slots__ = ('day', 'input_tokens', 'output_tokens', 'requests', 'loaded')
+    COUNTERS = ('input_tokens', 'output_tokens', 'requests')
+
+    def __init__(self, day: str, input_tokens: int = 0, output_tokens: int = 0, requests: int = 0):
+        self.day = day
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.requests = requests
+        self.loaded = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+class UsageTracker:
+    def __init__(self, db_client=None, daily_token_cap: int = 0):
+        self.db_client = db_client
+        self.daily_token_cap = daily_token_cap
+        self.recorded = 0
+        self.capped = 0
+        self._usage: Dict[int, _DailyUsage] = {}
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    async def setup(self):
+        if self.db_client:
+            await self.db_client.ensure_usage_indexes()
+
+    def cap_for(self, settings: Optional[Dict[str, Any]] = None) -> int:
+        try:
+            return int((settings or {}).get('daily_token_cap', self.daily_token_cap) or 0)
+        except (TypeError, ValueError):
+            return self.daily_token_cap
+
+    async def _today(self, guild_id: int) -> _DailyUsage:
+        day = utc_day()
+        usage = self._usage.get(guild_id)
+        if usage is not None and usage.day == day and usage.loaded:
+            return usage
+
+        pending = self._pending.get(guild_id)
+        if pending is not None:
+            return await pending
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[guild_id] = future
+        try:
+            if usage is None or usage.day != day:
+                usage = self._usage[guild_id] = _DailyUsage(day)
+            before = [getattr(usage, field) for field in _DailyUsage.COUNTERS]
+            if self.db_client:
+                try:
+                    flushed = await self.db_client.flush_usage(guild_id, day)
+                    doc = await self.db_client.load_usage(guild_id, day) or {}
+                except Exception as e:
+                    logger.error(f"Error loading usage for guild {guild_id}, counting only this process's usage today: {e}")
+                else:
+                    for field, recorded in zip(_DailyUsage.COUNTERS, before):
+                        counted = getattr(usage, field) - recorded if flushed else getattr(usage, field)
+                        setattr(usage, field, doc.get(field, 0) + counted)
+            usage.loaded = True
+            future.set_result(usage)
+            return usage
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            self._pending.pop(guild_id, None)
+
+    async def remaining(self, guild_id: int, settings: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        cap = self.cap_for(settings)
+        if cap <= 0:
+            return None
+        usage = await self._today(guild_id)
+        return max(0, cap - usage.total_tokens)
+
+    async def allow(self, guild_id: int, settings: Optional[Dict[str, Any]] = None) -> bool:
+        remaining = await self.remaining(guild_id, settings)
+        if remaining is None or remaining > 0:
+            return True
+        self.capped += 1
+        return False
+
+    def record(self, usage: TokenUsage):
+        if usage.guild_id is None:
+            return
+        day = utc_day()
+        daily = self._usage.get(usage.guild_id)
+        if daily is None or daily.day != day:
+            daily = self._usage[usage.guild_id] = _DailyUsage(day)
+        daily.input_tokens += usage.input_tokens
+        daily.output_tokens += usage.output_tokens
+        daily.requests += 1
+        self.recorded += 1
+        if self.db_client:
+            self.db_client.record_usage(usage.guild_id, day, usage.input_tokens, usage.output_tokens)
+
+    def usage_today(self, guild_id: int) -> Optional[Dict[str, int]]:
+        usage = self._usage.get(guild_id)
+        if usage is None or usage.day != utc_day():
+            return None
+        return {'input_tokens': usage.input_tokens, 'output_tokens': usage.output_tokens, 'requests': usage.requests}
+
+    def stats(self) -> Dict[str, int]:
+        day = utc_day()
+        today = [usage for usage in self._usage.values() if usage.day == day]
+        return {
+            'guilds_today': len(today),
+            'tokens_today': sum(usage.total_tokens for usage in today),
+            'recorded': self.recorded,
+            'capped': self.capped,
+        }